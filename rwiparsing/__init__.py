@@ -1,3 +1,4 @@
 from .p2mdoa import P2MDoA
 from .p2mpaths import P2mPaths
 from .p2mcir import P2mCir
+from .p2mgrid import P2mGrid
@@ -0,0 +1,136 @@
+'''
+Concurrent loading of many small files from high latency filesystems (e.g. NFS).
+
+Opening a file over the network costs much more than parsing it, so the files are read concurrently
+(each one with a single read, on a thread pool driven by asyncio) and parsed from memory, on the same
+pool so the event loop is never blocked by a parse. The members of a tar archive are read together, in
+a single pass over the archive.
+> parsers = load(glob.glob('results/run*/study/*.doa.*.p2m'), max_concurrency=64)
+'''
+import asyncio
+import concurrent.futures
+import functools
+import re
+import time
+
+from .p2mcir import P2mCir
+from .p2mdoa import P2MDoA
+from .p2mfileparser import MIMOCsvParser, P2mFileParser, P2mPathParser
+from .p2mopen import p2m_basename, read_archive_members, read_p2m_bytes, split_archive_member
+from .p2mpaths import P2mPaths
+
+# parser of the file types with their own class, other per-path types use P2mPathParser and single-layer
+# types P2mFileParser
+parsers = {'paths': P2mPaths, 'doa': P2MDoA, 'dod': P2MDoA, 'cir': P2mCir,
+           'cef': P2mPathParser, 'toa': P2mPathParser, 'doppler': P2mPathParser}
+
+
+def get_parser_class(filename):
+    """Parser class for a file, chosen by its name"""
+    name = p2m_basename(filename)
+    if name.endswith('.csv'):
+        return MIMOCsvParser
+    match = re.match(P2mFileParser._filename_match_re, name)
+    if match is None:
+        raise ValueError(filename + ' is not a p2m file name')
+    return parsers.get(match.group('type'), P2mFileParser)
+
+
+def _file_reader(filenames, max_concurrency, executor, reader, archive_reader):
+    """coroutine function reading a file of filenames on executor, at most max_concurrency at a time"""
+    loop = asyncio.get_running_loop()
+    semaphore = asyncio.Semaphore(max_concurrency)
+    members = {}
+    for filename in filenames:
+        archive, member = split_archive_member(filename)
+        if member is not None:
+            members.setdefault(archive, []).append(filename)
+    # one read of all the requested members of each archive, shared by their coroutines
+    archive_reads = {}
+
+    async def read_archive(archive):
+        async with semaphore:
+            return await loop.run_in_executor(executor, archive_reader, members[archive])
+
+    async def read(filename):
+        archive, member = split_archive_member(filename)
+        if member is not None:
+            if archive not in archive_reads:
+                archive_reads[archive] = asyncio.ensure_future(read_archive(archive))
+            return (await archive_reads[archive])[filename]
+        async with semaphore:
+            return await loop.run_in_executor(executor, reader, filename)
+
+    return read
+
+
+async def read_files(filenames, max_concurrency=64, executor=None, reader=read_p2m_bytes,
+                     archive_reader=read_archive_members):
+    """Read the files concurrently and return their contents, in the order of filenames
+
+    At most max_concurrency files are read at a time. reader(filename) returns the bytes of a file; it
+    runs on executor (by default a thread pool of max_concurrency threads). reader is not used for
+    archive members: archive_reader(filenames) reads all the requested members of an archive at once
+    and returns a dict of their bytes, see p2mopen.read_archive_members
+    """
+    own_executor = executor is None
+    if own_executor:
+        executor = concurrent.futures.ThreadPoolExecutor(max_concurrency)
+    read = _file_reader(filenames, max_concurrency, executor, reader, archive_reader)
+
+    try:
+        return await asyncio.gather(*(read(filename) for filename in filenames))
+    finally:
+        if own_executor:
+            executor.shutdown(wait=False)
+
+
+async def load_files(filenames, parser_class=None, max_concurrency=64, dtype_policy='float64', executor=None,
+                     reader=read_p2m_bytes, archive_reader=read_archive_members):
+    """Read the files concurrently and parse each one from memory as soon as it is read
+
+    parser_class is chosen from each file name if None. The files are read as in read_files and parsed
+    on executor too. Return the parsers in the order of filenames
+    """
+    loop = asyncio.get_running_loop()
+    own_executor = executor is None
+    if own_executor:
+        executor = concurrent.futures.ThreadPoolExecutor(max_concurrency)
+    read = _file_reader(filenames, max_concurrency, executor, reader, archive_reader)
+
+    async def load_file(filename):
+        buffer = await read(filename)
+        file_parser_class = parser_class if parser_class is not None else get_parser_class(filename)
+        parse = functools.partial(file_parser_class, filename, dtype_policy, buffer=buffer)
+        return await loop.run_in_executor(executor, parse)
+
+    try:
+        return await asyncio.gather(*(load_file(filename) for filename in filenames))
+    finally:
+        if own_executor:
+            executor.shutdown(wait=False)
+
+
+def load(filenames, parser_class=None, max_concurrency=64, dtype_policy='float64', reader=read_p2m_bytes,
+         archive_reader=read_archive_members):
+    """Synchronous version of load_files"""
+    return asyncio.run(load_files(filenames, parser_class, max_concurrency, dtype_policy, reader=reader,
+                                  archive_reader=archive_reader))
+
+
+def _delayed_read(latency, reader, filename):
+    time.sleep(latency)
+    return reader(filename)
+
+
+def with_latency(latency, reader=read_p2m_bytes):
+    """reader that waits latency seconds before each read, to emulate a network filesystem. Works for
+    archive readers too: with_latency(latency, read_archive_members)"""
+    return functools.partial(_delayed_read, latency, reader)
+
+
+if __name__ == '__main__':
+    filenames = ['../example/iter0.doa.t001_05.r006.p2m'] * 100
+    start = time.perf_counter()
+    parsers_loaded = load(filenames, max_concurrency=50, reader=with_latency(0.02))
+    print('loaded %d files in %.2f s' % (len(parsers_loaded), time.perf_counter() - start))
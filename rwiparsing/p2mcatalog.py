@@ -0,0 +1,304 @@
+'''
+SQLite catalog of the p2m files of a simulation.
+
+The catalog records the metadata of each file name (project, type, transmitter, transmitter set,
+receiver set and the run number found in its path) and, for paths, doa, dod and cir files, a summary
+of each receiver (number of paths, total power, LOS) with the byte offset of its data. Queries are
+answered from the catalog and only the matching receivers are parsed afterwards.
+
+The total power of a receiver is always in dBm. For paths files it is the received power InSite writes
+for the receiver (power_method 'insite'); doa, dod and cir files have no such total, so their ray powers
+are summed incoherently (power_method 'incoherent', with the linear powers in W of cir files converted
+to dBm).
+> catalog = P2mCatalog('simulation.sqlite')
+> catalog.add_tree('results')
+> for paths in catalog.load(p2m_type='paths', transmitter=1, receiver_set=6, run_min=1000, run_max=2000, los=True):
+>     ...
+'''
+import collections
+import concurrent.futures
+import os
+import re
+import sqlite3
+
+import numpy as np
+
+from .p2mcir import P2mCir
+from .p2mdoa import P2MDoA, scan_receiver_offsets
+from .p2mfileparser import P2mFileParser
+from .p2mopen import archive_separator, iter_archive_members, p2m_basename, read_archive_members, split_archive_member
+from .p2mpaths import P2mPaths
+
+# parser of each file type with per receiver data
+parsers = {'paths': P2mPaths, 'doa': P2MDoA, 'dod': P2MDoA, 'cir': P2mCir}
+
+_run_re = re.compile(r'run(\d+)')
+_archive_extensions = ('.tar', '.tar.gz', '.tgz', '.tar.bz2', '.tar.xz')
+
+_schema = '''
+CREATE TABLE IF NOT EXISTS files (
+    id INTEGER PRIMARY KEY,
+    filename TEXT UNIQUE NOT NULL,
+    mtime REAL NOT NULL,
+    project TEXT,
+    type TEXT,
+    transmitter INTEGER,
+    transmitter_set INTEGER,
+    receiver_set INTEGER,
+    run INTEGER,
+    n_receivers INTEGER
+);
+CREATE INDEX IF NOT EXISTS files_meta ON files (type, transmitter, receiver_set, run);
+CREATE TABLE IF NOT EXISTS receivers (
+    file_id INTEGER NOT NULL REFERENCES files (id) ON DELETE CASCADE,
+    receiver INTEGER NOT NULL,
+    n_paths INTEGER NOT NULL,
+    total_power REAL,
+    power_method TEXT,
+    los INTEGER,
+    offset INTEGER NOT NULL,
+    PRIMARY KEY (file_id, receiver)
+);
+'''
+
+
+def summarize_file(filename, buffer=None):
+    """Return the row of the files table and the rows of the receivers table of a p2m file
+
+    If buffer (the bytes of the file) is given it is used instead of reading the file. Raise ValueError
+    if the name is not a p2m file name
+    """
+    match = re.match(P2mFileParser._filename_match_re, p2m_basename(filename))
+    if match is None:
+        raise ValueError(filename + ' is not a p2m file name')
+    archive = split_archive_member(filename)[0]
+    run = _run_re.findall(filename)
+    file_row = {
+        'filename': filename,
+        'mtime': os.path.getmtime(archive),
+        'project': match.group('project'),
+        'type': match.group('type'),
+        'transmitter': int(match.group('transmitter')),
+        'transmitter_set': int(match.group('transmitter_set')),
+        'receiver_set': int(match.group('receiver_set')),
+        'run': int(run[-1]) if run else None,
+        'n_receivers': None,
+    }
+    receiver_rows = []
+    if file_row['type'] in parsers:
+        receivers, n_paths, offsets = scan_receiver_offsets(filename, buffer)
+        parser = parsers[file_row['type']](filename, buffer=buffer)
+        file_row['n_receivers'] = len(receivers)
+        for receiver, receiver_n_paths, offset in zip(receivers.tolist(), n_paths.tolist(), offsets.tolist()):
+            total_power, power_method, los = _summarize_receiver(parser, file_row['type'], receiver)
+            receiver_rows.append((receiver, receiver_n_paths, total_power, power_method, los, offset))
+    return file_row, receiver_rows
+
+
+def _summarize_receiver(parser, p2m_type, receiver):
+    """total power (dBm), the method giving it and LOS flag of a receiver, None when unknown"""
+    data = parser.data.get(receiver)
+    if data is None:
+        return None, None, None
+    if p2m_type == 'paths':
+        return float(data['received_power']), 'insite', int(bool(np.any(parser.is_los(receiver))))
+    if p2m_type == 'cir':
+        # cir powers are linear, in W
+        linear_power = np.array([data[path+1]['srcvdpower'] for path in range(data['paths_number'])]) * 1e3
+    else:
+        linear_power = 10 ** (np.array([direction[2] for direction in data.values()]) / 10)
+    if len(linear_power) == 0:
+        return None, None, None
+    with np.errstate(divide='ignore'):
+        return float(10 * np.log10(np.sum(linear_power))), 'incoherent', None
+
+
+def _is_under(filename, root):
+    """whether a file (or the archive of an archive member) is in the tree of root"""
+    archive = os.path.abspath(split_archive_member(filename)[0])
+    return os.path.commonpath([archive, os.path.abspath(root)]) == os.path.abspath(root)
+
+
+class P2mCatalog:
+    """Catalog of p2m files stored in a SQLite database (use ':memory:' for a temporary one)"""
+
+    def __init__(self, database):
+        self.database = database
+        self.errors = []
+        self.connection = sqlite3.connect(database)
+        self.connection.execute('PRAGMA foreign_keys = ON')
+        self.connection.executescript(_schema)
+        columns = [row[1] for row in self.connection.execute('PRAGMA table_info(receivers)')]
+        if 'power_method' not in columns:
+            # catalogs created before the power method was recorded
+            self.connection.execute('ALTER TABLE receivers ADD COLUMN power_method TEXT')
+
+    def close(self):
+        self.connection.close()
+
+    def add_file(self, filename):
+        """Add (or update) a file in the catalog"""
+        self._insert([summarize_file(filename)])
+
+    def add_tree(self, root, n_workers=None):
+        """Add all p2m files under root (including members of tar archives) that are new or changed
+        since they were cataloged
+
+        The files are summarized on a process pool and added as soon as they are summarized. At most
+        2 * n_workers files are pending, so only their contents are held in memory. Archives are
+        decompressed once, in a single pass, and skipped when unchanged. Files that cannot be summarized
+        are left out and listed in errors, as (filename, error message). Files under root that are in
+        the catalog but no longer in the tree are removed from it. Return the number of files added
+        """
+        n_workers = n_workers if n_workers is not None else os.cpu_count()
+        known = dict(self.connection.execute('SELECT filename, mtime FROM files'))
+        known_archives = {}
+        for filename, mtime in known.items():
+            archive, member = split_archive_member(filename)
+            if member is not None:
+                known_archives.setdefault(archive, set()).add(mtime)
+        self.errors = []
+        seen = set()
+        pending = {}
+        n_added = 0
+
+        def collect(return_when):
+            nonlocal n_added
+            done, _ = concurrent.futures.wait(pending, return_when=return_when)
+            for future in done:
+                filename = pending.pop(future)
+                try:
+                    summary = future.result()
+                except Exception as error:
+                    self.errors.append((filename, repr(error)))
+                    continue
+                self._insert([summary])
+                n_added += 1
+
+        def submit(executor, filename, *arguments):
+            if len(pending) >= 2 * n_workers:
+                collect(concurrent.futures.FIRST_COMPLETED)
+            pending[executor.submit(summarize_file, filename, *arguments)] = filename
+
+        with concurrent.futures.ProcessPoolExecutor(n_workers) as executor:
+            for directory, dirnames, names in os.walk(root):
+                dirnames.sort()
+                for name in sorted(names):
+                    path = os.path.join(directory, name)
+                    mtime = os.path.getmtime(path)
+                    if not name.endswith(_archive_extensions):
+                        seen.add(path)
+                        if self._is_p2m_name(path) and known.get(path) != mtime:
+                            submit(executor, path)
+                        continue
+                    if known_archives.get(path) == {mtime}:
+                        seen.update(filename for filename in known
+                                    if split_archive_member(filename)[0] == path)
+                        continue
+                    for filename, buffer in iter_archive_members(path):
+                        seen.add(filename)
+                        if self._is_p2m_name(filename) and known.get(filename) != mtime:
+                            submit(executor, filename, buffer)
+            collect(concurrent.futures.ALL_COMPLETED)
+        self._remove(filename for filename in known if filename not in seen and _is_under(filename, root))
+        return n_added
+
+    def _remove(self, filenames):
+        with self.connection:
+            self.connection.executemany('DELETE FROM files WHERE filename = ?', ((filename,) for filename in filenames))
+
+    @staticmethod
+    def _is_p2m_name(filename):
+        return re.match(P2mFileParser._filename_match_re, p2m_basename(filename)) is not None
+
+    def _insert(self, summaries):
+        with self.connection:
+            for file_row, receiver_rows in summaries:
+                self.connection.execute('DELETE FROM files WHERE filename = ?', (file_row['filename'],))
+                columns = ', '.join(file_row)
+                cursor = self.connection.execute(
+                    'INSERT INTO files (' + columns + ') VALUES (' + ', '.join('?' * len(file_row)) + ')',
+                    tuple(file_row.values()))
+                self.connection.executemany(
+                    'INSERT INTO receivers (file_id, receiver, n_paths, total_power, power_method, los, offset) '
+                    'VALUES (?, ?, ?, ?, ?, ?, ?)',
+                    [(cursor.lastrowid,) + row for row in receiver_rows])
+
+    def query_files(self, **conditions):
+        """Return the file names matching the conditions (see query_receivers for the list)"""
+        where, parameters = self._where(conditions)
+        return [row[0] for row in self.connection.execute(
+            'SELECT DISTINCT files.filename FROM files LEFT JOIN receivers ON receivers.file_id = files.id' +
+            where + ' ORDER BY files.filename', parameters)]
+
+    def query_receivers(self, **conditions):
+        """Return (filename, receiver, offset) of the receivers matching the conditions
+
+        conditions are any of p2m_type, project, transmitter, transmitter_set, receiver_set (values or
+        lists of values), run_min, run_max, los (True/False), min_paths, min_power (dBm) and power_method
+        ('insite' or 'incoherent', see the module documentation)
+        """
+        where, parameters = self._where(conditions)
+        return self.connection.execute(
+            'SELECT files.filename, receivers.receiver, receivers.offset FROM files '
+            'JOIN receivers ON receivers.file_id = files.id' + where +
+            ' ORDER BY files.filename, receivers.offset', parameters).fetchall()
+
+    def load(self, dtype_policy='float64', **conditions):
+        """Parse the receivers matching the conditions (see query_receivers), yielding one parser per file
+
+        The matching members of an archive are read together, in a single pass over the archive
+        """
+        rows = self.query_receivers(**conditions)
+        offsets = collections.OrderedDict()
+        for filename, receiver, offset in rows:
+            offsets.setdefault(filename, []).append(offset)
+        archive, buffers = None, {}
+        for filename, file_offsets in offsets.items():
+            if archive_separator in filename and split_archive_member(filename)[0] != archive:
+                archive = split_archive_member(filename)[0]
+                buffers = read_archive_members(name for name in offsets if split_archive_member(name)[0] == archive)
+            p2m_type = self.connection.execute('SELECT type FROM files WHERE filename = ?', (filename,)).fetchone()[0]
+            yield parsers[p2m_type](filename, dtype_policy, file_offsets, buffers.pop(filename, None))
+
+    @staticmethod
+    def _where(conditions):
+        clauses, parameters = [], []
+        columns = {'p2m_type': 'files.type', 'project': 'files.project', 'transmitter': 'files.transmitter',
+                   'transmitter_set': 'files.transmitter_set', 'receiver_set': 'files.receiver_set',
+                   'power_method': 'receivers.power_method'}
+        for name, value in conditions.items():
+            if value is None:
+                continue
+            if name in columns:
+                values = list(value) if isinstance(value, (list, tuple, set, range)) else [value]
+                clauses.append(columns[name] + ' IN (' + ', '.join('?' * len(values)) + ')')
+                parameters += values
+            elif name == 'run_min':
+                clauses.append('files.run >= ?')
+                parameters.append(value)
+            elif name == 'run_max':
+                clauses.append('files.run <= ?')
+                parameters.append(value)
+            elif name == 'los':
+                clauses.append('receivers.los = ?')
+                parameters.append(int(bool(value)))
+            elif name == 'min_paths':
+                clauses.append('receivers.n_paths >= ?')
+                parameters.append(value)
+            elif name == 'min_power':
+                clauses.append('receivers.total_power >= ?')
+                parameters.append(value)
+            else:
+                raise ValueError("unknown catalog condition '" + name + "'")
+        if not clauses:
+            return '', parameters
+        return ' WHERE ' + ' AND '.join(clauses), parameters
+
+
+if __name__ == '__main__':
+    catalog = P2mCatalog(':memory:')
+    catalog.add_tree('../example')
+    print('files: ', catalog.query_files(p2m_type='paths', transmitter=1))
+    for paths in catalog.load(p2m_type='paths', los=True):
+        print(paths.filename, list(paths.data.keys()))
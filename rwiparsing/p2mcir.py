@@ -30,7 +30,7 @@ class P2mCir(P2mFileParser):
         '''Returns all phases in degrees. antenna_number starts with 1 (not 0).'''
         if self.data[antenna_number] is None:
             return None
-        data_ndarray = np.zeros((self.data[antenna_number]['paths_number'],))
+        data_ndarray = np.zeros((self.data[antenna_number]['paths_number'],), dtype=self.dtype_policy.angle)
         for paths in range(self.data[antenna_number]['paths_number']):
             data_ndarray[paths] = self.data[antenna_number][paths+1]['phase']
         return data_ndarray
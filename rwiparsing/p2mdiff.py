@@ -0,0 +1,341 @@
+'''
+Comparison of two simulation trees (e.g. the same scenarios run with two InSite versions).
+
+Files are paired by their relative directory and the metadata in their names (project, type,
+transmitter, transmitter set and receiver set). paths, doa, dod and cir files are compared ray by ray
+with a tolerance per kind of column. Rays are compared in file order first; receivers whose rays do
+not agree in order are matched again by the closest rays (same interactions, for paths files). Powers
+are compared in dB: the linear powers (W) of cir files are converted to dBm first. Columns missing
+from one of the files (the phase of InSite 3.2 paths files) are left out of the comparison and reported.
+Members of tar archives are paired as the files they were archived from; each compared member is
+read on its own, which decompresses a compressed archive from its start every time.
+> report = diff_trees('simu_3.2', 'simu_3.3')
+> print(format_report(report))
+'''
+import concurrent.futures
+import os
+import re
+
+import numpy as np
+
+from .p2mcir import P2mCir
+from .p2mdoa import P2MDoA
+from .p2mfileparser import P2mFileParser
+from .p2mopen import list_archive_members, p2m_basename, split_archive_member
+from .p2mpaths import P2mPaths
+
+# default tolerance for each kind of column: dB, seconds and degrees
+default_tolerances = {'power': 0.01, 'time': 1e-11, 'angle': 0.01}
+
+_archive_extensions = ('.tar', '.tar.gz', '.tgz', '.tar.bz2', '.tar.xz')
+
+# columns of the ray tables of each file type, as (name, kind)
+ray_columns = {
+    'paths': [('power', 'power'), ('arrival_time', 'time'), ('departure_theta', 'angle'),
+              ('departure_phi', 'angle'), ('arrival_theta', 'angle'), ('arrival_phi', 'angle'),
+              ('phase', 'angle')],
+    'doa': [('phi', 'angle'), ('theta', 'angle'), ('power', 'power')],
+    'dod': [('phi', 'angle'), ('theta', 'angle'), ('power', 'power')],
+    'cir': [('phase', 'angle'), ('arrival_time', 'time'), ('power', 'power')],
+}
+
+
+def find_p2m_files(root):
+    """Map the pairing key (relative directory, project, type, tx, tx set, rx set) of each p2m file under root to its path
+
+    The members of tar archives are included, with the directory of the archive joined to their own
+    directory, so run00001.tar.xz::run00001/study/x.p2m pairs with run00001/study/x.p2m. Files sharing
+    a key (e.g. x.p2m and x.p2m.gz) cannot be paired, they are left out and returned separately. Return
+    the files and the duplicates, a dict mapping their keys to the list of their paths
+    """
+    files = {}
+    duplicates = {}
+    for directory, dirnames, filenames in os.walk(root):
+        dirnames.sort()
+        for filename in sorted(filenames):
+            path = os.path.join(directory, filename)
+            if filename.endswith(_archive_extensions):
+                paths = list_archive_members(path)
+            else:
+                paths = [path]
+            for path in paths:
+                key = _pairing_key(root, path)
+                if key is not None:
+                    _add_file(files, duplicates, key, path)
+    return files, duplicates
+
+
+def _pairing_key(root, path):
+    match = re.match(P2mFileParser._filename_match_re, p2m_basename(path))
+    if match is None:
+        return None
+    archive, member = split_archive_member(path)
+    directory = os.path.relpath(os.path.dirname(archive), root)
+    if member is not None:
+        directory = os.path.normpath(os.path.join(directory, os.path.dirname(member)))
+    return (directory, match.group('project'), match.group('type'), int(match.group('transmitter')),
+            int(match.group('transmitter_set')), int(match.group('receiver_set')))
+
+
+def _add_file(files, duplicates, key, path):
+    if key in duplicates:
+        duplicates[key].append(path)
+    elif key in files:
+        duplicates[key] = [files.pop(key), path]
+    else:
+        files[key] = path
+
+
+def load_ray_table(filename, p2m_type):
+    """Return the receiver numbers, the zero padded rays shaped (receivers, paths, columns), the number
+    of paths per receiver, for paths files the interactions of each ray (None otherwise) and the names of
+    the columns of ray_columns found in the file (the others are zero)"""
+    labels = None
+    columns = [name for name, kind in ray_columns[p2m_type]]
+    if p2m_type == 'paths':
+        paths = P2mPaths(filename)
+        receivers, data_ndarray, n_paths, labels = paths_ray_table(paths)
+        with_rays = [receiver for receiver in paths.data.values() if receiver is not None]
+        if with_rays and 'phase' not in with_rays[0].rays.dtype.names:
+            # InSite 3.2 files have no phase
+            columns.remove('phase')
+    elif p2m_type in ('doa', 'dod'):
+        doa = P2MDoA(filename)
+        receivers = np.array(list(doa.data.keys()))
+        n_paths = np.array([len(paths) for paths in doa.data.values()])
+        data_ndarray = doa.get_data_ndarray() if len(receivers) > 0 else np.zeros((0, 0, 3))
+    elif p2m_type == 'cir':
+        cir = P2mCir(filename)
+        receivers = np.array(list(cir.data.keys()))
+        n_paths = np.array([0 if rays is None else rays['paths_number'] for rays in cir.data.values()])
+        data_ndarray = np.zeros((len(receivers), n_paths.max() if len(n_paths) > 0 else 0, 3))
+        for rec_idx, rays in enumerate(cir.data.values()):
+            for path_idx in range(n_paths[rec_idx]):
+                ray = rays[path_idx+1]
+                data_ndarray[rec_idx, path_idx] = ray['phase'], ray['arrival_time'], ray['srcvdpower']
+        # compare the linear powers (W) in dBm, zero powers (if any) at the smallest positive power
+        power = np.maximum(data_ndarray[:, :, 2], np.finfo(np.float64).tiny)
+        data_ndarray[:, :, 2] = 10 * np.log10(power) + 30
+    else:
+        raise ValueError("comparison of *." + p2m_type + ".p2m files is not supported")
+    return receivers, data_ndarray, n_paths, labels, columns
+
+
+def paths_ray_table(paths):
+    """receivers, rays, number of paths and interactions of load_ray_table for a parsed P2mPaths"""
+    data_ndarray, n_paths = paths.get_rays_ndarray()
+    receivers = np.array(list(paths.data.keys()))
+    labels = np.full(data_ndarray.shape[:2], '', dtype=object)
+    for rec_idx, receiver in enumerate(receivers):
+        if paths.data[receiver] is not None:
+            labels[rec_idx, :n_paths[rec_idx]] = paths.get_interactions_list(receiver)
+    return receivers, data_ndarray, n_paths, labels
+
+
+def match_rays(cost, max_cost=np.inf):
+    """Greedy assignment of rows to columns of a cost matrix, cheapest pairs first
+
+    Pairs costing more than max_cost are never matched. Return the matched row and column indices
+    """
+    order = np.argsort(cost, axis=None, kind='stable')
+    order = order[cost.ravel()[order] <= max_cost]
+    rows, columns = np.unravel_index(order, cost.shape)
+    row_used = np.zeros(cost.shape[0], dtype=bool)
+    column_used = np.zeros(cost.shape[1], dtype=bool)
+    matched = []
+    for pair, (row, column) in enumerate(zip(rows, columns)):
+        if row_used[row] or column_used[column]:
+            continue
+        row_used[row] = column_used[column] = True
+        matched.append(pair)
+        if len(matched) == min(cost.shape):
+            break
+    return rows[matched], columns[matched]
+
+
+def ray_differences(rays_a, rays_b, kinds):
+    """Absolute differences between rays (broadcast over leading axes), wrapping angles to [0, 180]"""
+    difference = np.abs(rays_a - rays_b)
+    is_angle = np.array([kind == 'angle' for kind in kinds])
+    difference[..., is_angle] = np.abs((difference[..., is_angle] + 180) % 360 - 180)
+    return difference
+
+
+def diff_files(filename_a, filename_b, p2m_type, tolerances=None, match_factor=10):
+    """Compare two files of the same type and return a report (dict)
+
+    tolerances maps column names or kinds ('power', 'time', 'angle') to absolute tolerances. Rays are
+    matched when all their columns differ by less than match_factor times the tolerance. Columns found
+    in only one of the files are not compared
+    """
+    receivers_a, data_a, n_paths_a, labels_a, columns_a = load_ray_table(filename_a, p2m_type)
+    receivers_b, data_b, n_paths_b, labels_b, columns_b = load_ray_table(filename_b, p2m_type)
+    compared = np.array([name in columns_a and name in columns_b for name, kind in ray_columns[p2m_type]])
+    names = [name for name, kind in ray_columns[p2m_type] if name in columns_a and name in columns_b]
+    kinds = [kind for name, kind in ray_columns[p2m_type] if name in columns_a and name in columns_b]
+    tolerance = _column_tolerances(p2m_type, tolerances)[compared]
+    data_a, data_b = data_a[..., compared], data_b[..., compared]
+    common, index_a, index_b = np.intersect1d(receivers_a, receivers_b, return_indices=True)
+    # pad both tables to the same number of paths
+    biggest_n_paths = max(data_a.shape[1], data_b.shape[1])
+    data_a, data_b = _pad_paths(data_a[index_a], biggest_n_paths), _pad_paths(data_b[index_b], biggest_n_paths)
+    n_paths_a, n_paths_b = n_paths_a[index_a], n_paths_b[index_b]
+    valid_a = np.arange(biggest_n_paths) < n_paths_a[:, np.newaxis]
+    valid_b = np.arange(biggest_n_paths) < n_paths_b[:, np.newaxis]
+    if labels_a is not None:
+        labels_a, labels_b = _pad_paths(labels_a[index_a], biggest_n_paths), _pad_paths(labels_b[index_b], biggest_n_paths)
+
+    # compare in file order, all receivers at once
+    difference = ray_differences(data_a, data_b, kinds) / tolerance
+    ray_agrees = np.all(difference <= 1, axis=2)
+    if labels_a is not None:
+        ray_agrees &= labels_a == labels_b
+    in_order = (n_paths_a == n_paths_b) & np.all(ray_agrees | ~valid_a, axis=1)
+
+    # receivers with differences are matched ray by ray
+    matched_a = [data_a[in_order][valid_a[in_order]]]
+    matched_b = [data_b[in_order][valid_b[in_order]]]
+    unmatched_a = unmatched_b = 0
+    for rec_idx in np.flatnonzero(~in_order):
+        rays_a = data_a[rec_idx, :n_paths_a[rec_idx]]
+        rays_b = data_b[rec_idx, :n_paths_b[rec_idx]]
+        cost = ray_differences(rays_a[:, np.newaxis], rays_b[np.newaxis], kinds) / tolerance
+        cost = cost.max(axis=2)
+        if labels_a is not None:
+            same_interactions = (labels_a[rec_idx, :n_paths_a[rec_idx], np.newaxis] ==
+                                 labels_b[rec_idx, np.newaxis, :n_paths_b[rec_idx]])
+            cost[~same_interactions] = np.inf
+        rows, columns = match_rays(cost, match_factor)
+        matched_a.append(rays_a[rows])
+        matched_b.append(rays_b[columns])
+        unmatched_a += len(rays_a) - len(rows)
+        unmatched_b += len(rays_b) - len(columns)
+    matched_a = np.concatenate(matched_a)
+    matched_b = np.concatenate(matched_b)
+    difference = ray_differences(matched_a, matched_b, kinds)
+    out_of_tolerance = difference > tolerance
+
+    report = {
+        'file_a': filename_a,
+        'file_b': filename_b,
+        'type': p2m_type,
+        'columns_only_in_a': [name for name in columns_a if name not in columns_b],
+        'columns_only_in_b': [name for name in columns_b if name not in columns_a],
+        'receivers_only_in_a': np.setdiff1d(receivers_a, receivers_b).tolist(),
+        'receivers_only_in_b': np.setdiff1d(receivers_b, receivers_a).tolist(),
+        'receivers_reordered': int(np.count_nonzero(~in_order)),
+        'receivers_with_different_n_paths': int(np.count_nonzero(n_paths_a != n_paths_b)),
+        'rays_matched': len(matched_a),
+        'rays_unmatched_a': int(unmatched_a),
+        'rays_unmatched_b': int(unmatched_b),
+        'rays_out_of_tolerance': int(np.count_nonzero(np.any(out_of_tolerance, axis=1))),
+        'max_abs_diff': dict(zip(names, difference.max(axis=0).tolist() if len(difference) else [0.0] * len(names))),
+        'out_of_tolerance': dict(zip(names, np.count_nonzero(out_of_tolerance, axis=0).tolist())),
+    }
+    report['equal'] = (not report['receivers_only_in_a'] and not report['receivers_only_in_b'] and
+                       unmatched_a == 0 and unmatched_b == 0 and report['rays_out_of_tolerance'] == 0)
+    return report
+
+
+def _column_tolerances(p2m_type, tolerances):
+    tolerances = {} if tolerances is None else tolerances
+    return np.array([tolerances.get(name, tolerances.get(kind, default_tolerances[kind]))
+                     for name, kind in ray_columns[p2m_type]])
+
+
+def _pad_paths(data_ndarray, n_paths):
+    padding = [(0, 0)] * data_ndarray.ndim
+    padding[1] = (0, n_paths - data_ndarray.shape[1])
+    if data_ndarray.dtype == object:
+        return np.pad(data_ndarray, padding, constant_values='')
+    return np.pad(data_ndarray, padding)
+
+
+def _diff_pair(arguments):
+    key, filename_a, filename_b, tolerances, match_factor = arguments
+    try:
+        report = diff_files(filename_a, filename_b, key[2], tolerances, match_factor)
+    except Exception as error:
+        report = {'file_a': filename_a, 'file_b': filename_b, 'type': key[2], 'equal': False,
+                  'error': repr(error)}
+    report['key'] = key
+    return report
+
+
+def diff_trees(root_a, root_b, tolerances=None, match_factor=10, n_workers=None, types=None):
+    """Compare all supported p2m files found under two directories, on a process pool
+
+    types restricts the comparison to some file types (default: all types in ray_columns). Return a
+    report with the list of per file reports, the files found in only one of the trees and the files
+    left out because another file of the same tree has the same pairing key
+    """
+    types = ray_columns.keys() if types is None else types
+    files_a, duplicates_a = find_p2m_files(root_a)
+    files_b, duplicates_b = find_p2m_files(root_b)
+    files_a = {key: name for key, name in files_a.items() if key[2] in types}
+    files_b = {key: name for key, name in files_b.items() if key[2] in types}
+    # a key duplicated in one tree is not compared, nor reported as missing from the other
+    duplicated = set(key for key in list(duplicates_a) + list(duplicates_b) if key[2] in types)
+    files_a = {key: name for key, name in files_a.items() if key not in duplicated}
+    files_b = {key: name for key, name in files_b.items() if key not in duplicated}
+    common = sorted(set(files_a) & set(files_b))
+    arguments = [(key, files_a[key], files_b[key], tolerances, match_factor) for key in common]
+    with concurrent.futures.ProcessPoolExecutor(n_workers) as executor:
+        file_reports = list(executor.map(_diff_pair, arguments, chunksize=max(1, len(arguments) // 64)))
+    return {
+        'root_a': root_a,
+        'root_b': root_b,
+        'files': file_reports,
+        'only_in_a': sorted(files_a[key] for key in set(files_a) - set(files_b)),
+        'only_in_b': sorted(files_b[key] for key in set(files_b) - set(files_a)),
+        'duplicates_in_a': sorted(duplicates_a[key] for key in duplicated if key in duplicates_a),
+        'duplicates_in_b': sorted(duplicates_b[key] for key in duplicated if key in duplicates_b),
+        'n_files_compared': len(file_reports),
+        'n_files_different': sum(not report['equal'] for report in file_reports),
+        'n_files_with_different_columns': sum(bool(report.get('columns_only_in_a') or report.get('columns_only_in_b'))
+                                              for report in file_reports),
+    }
+
+
+def format_report(report):
+    """Summary of a diff_trees report as text"""
+    lines = ['Comparing ' + str(report['root_a']) + ' and ' + str(report['root_b']),
+             '%d files compared, %d different, %d only in a, %d only in b, %d duplicated' %
+             (report['n_files_compared'], report['n_files_different'], len(report['only_in_a']),
+              len(report['only_in_b']), len(report['duplicates_in_a']) + len(report['duplicates_in_b']))]
+    if report['n_files_with_different_columns']:
+        lines.append('%d files with columns missing from one side, not compared (e.g. the phase of InSite 3.2 '
+                     'paths files)' % report['n_files_with_different_columns'])
+    for file_report in report['files']:
+        if file_report['equal']:
+            continue
+        lines.append(file_report['file_a'] + ' vs ' + file_report['file_b'])
+        if 'error' in file_report:
+            lines.append('    error: ' + file_report['error'])
+            continue
+        lines.append('    %d rays matched (%d receivers reordered), %d/%d unmatched, %d out of tolerance' %
+                     (file_report['rays_matched'], file_report['receivers_reordered'],
+                      file_report['rays_unmatched_a'], file_report['rays_unmatched_b'],
+                      file_report['rays_out_of_tolerance']))
+        if file_report['columns_only_in_a'] or file_report['columns_only_in_b']:
+            lines.append('    columns only in a: ' + str(file_report['columns_only_in_a']) +
+                         ', only in b: ' + str(file_report['columns_only_in_b']))
+        if file_report['receivers_only_in_a'] or file_report['receivers_only_in_b']:
+            lines.append('    receivers only in a: ' + str(file_report['receivers_only_in_a']) +
+                         ', only in b: ' + str(file_report['receivers_only_in_b']))
+        for name, value in file_report['max_abs_diff'].items():
+            if file_report['out_of_tolerance'][name]:
+                lines.append('    %s: max difference %g, %d rays out of tolerance' %
+                             (name, value, file_report['out_of_tolerance'][name]))
+    for filename in report['only_in_a']:
+        lines.append('only in a: ' + filename)
+    for filename in report['only_in_b']:
+        lines.append('only in b: ' + filename)
+    for side in ('a', 'b'):
+        for filenames in report['duplicates_in_' + side]:
+            lines.append('duplicated in ' + side + ', not compared: ' + ', '.join(filenames))
+    return '\n'.join(lines)
+
+
+if __name__ == '__main__':
+    print(format_report(diff_trees('../example', '../example')))
@@ -1,21 +1,29 @@
 import re
 import os
 import collections
+import mmap
 
 import numpy as np
 
+from .p2mdtype import get_dtype_policy
+from .p2mopen import compression_openers, open_p2m, p2m_basename, split_archive_member
+
+# receiver lines hold only the receiver number and its number of paths. In paths, doa, dod, cir, cef and toa
+# files no other line has exactly two integers, so they mark the receiver boundaries
+_receiver_line_re = re.compile(rb'^[ \t]*(\d+)[ \t]+(\d+)[ \t]*\r?$', re.MULTILINE)
+
 
 class ParsingError(Exception):
     pass
 
 
 class P2mFileParser:
-    """Parser for p2m files. It currently support doa, paths and cir. Notice the regular expression in the code."""
+    """Parser for p2m files. It currently support doa, dod, paths and cir. Notice the regular expression in the code."""
 
     # project.type.tx_y.rz.p2m
     _filename_match_re = (r'^(?P<project>.*)' +
                           r'\.' +
-                          r'(?P<type>((doa)|(paths)|(cir)))' +
+                          r'(?P<type>((doa)|(dod)|(paths)|(cir)))' +
                           r'\.' +
                           r't(?P<transmitter>\d+)'+
                           r'_' +
@@ -25,9 +33,15 @@ class P2mFileParser:
                           r'\.' +
                           r'p2m$')
 
-    def __init__(self, filename):
+    def __init__(self, filename, dtype_policy='float64', receiver_offsets=None, buffer=None):
+        """dtype_policy selects the dtypes of the parsed arrays, see p2mdtype. If receiver_offsets (byte
+        offsets of receiver lines, see scan_receiver_offsets) is given only those receivers are parsed.
+        If buffer (the bytes of the file) is given it is parsed instead of reading the file"""
         self.filename = filename
         self.file = None
+        self.dtype_policy = get_dtype_policy(dtype_policy)
+        self.receiver_offsets = receiver_offsets
+        self.buffer = buffer
         self._parse()
 
     def get_data_dict(self):
@@ -35,20 +49,27 @@ class P2mFileParser:
 
     def _parse_meta(self):
         match = re.match(P2mFileParser._filename_match_re,
-                         os.path.basename(self.filename))
+                         p2m_basename(self.filename))
 
         self.project = match.group('project')
+        self.p2m_type = match.group('type')
         self.transmitter_set = int(match.group('transmitter_set'))
         self.transmitter = int(match.group('transmitter'))
         self.receiver_set = int(match.group('receiver_set'))
 
     def _parse(self):
-        with open(self.filename) as self.file:
+        with open_p2m(self.filename, buffer=self.buffer) as self.file:
             self._parse_meta()
             self._parse_header()
             self.data = collections.OrderedDict()
-            for rec in range(self.n_receivers):
-                self._parse_receiver()
+            if self.receiver_offsets is None:
+                for rec in range(self.n_receivers):
+                    self._parse_receiver()
+            else:
+                for offset in self.receiver_offsets:
+                    self.file.seek(offset)
+                    self._parse_receiver()
+                self.n_receivers = len(self.data)
 
     def _parse_header(self):
         """read the first line of the file, indicating the number of receivers"""
@@ -74,6 +95,34 @@ class P2mFileParser:
             else:
                 return next_line
 
+def scan_receiver_offsets(filename, buffer=None):
+    """Find the receivers of a paths, doa, dod, cir, cef or toa file without parsing it
+
+    If buffer (the bytes of the file) is given it is scanned instead of reading the file. Return the
+    receiver numbers, their number of paths and the byte offsets of their lines, as ndarrays
+    """
+    archive, member = split_archive_member(filename)
+    if buffer is None and member is None and os.path.splitext(archive)[1] not in compression_openers:
+        # plain files are scanned in place
+        with open(archive, 'rb') as file:
+            if os.path.getsize(archive) == 0:
+                return _receiver_arrays([])
+            with mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as content:
+                return _receiver_arrays(_receiver_line_re.finditer(content))
+    with open_p2m(filename, 'rb', buffer=buffer) as file:
+        return _receiver_arrays(_receiver_line_re.finditer(file.read()))
+
+
+def _receiver_arrays(matches):
+    receivers, n_paths, offsets = [], [], []
+    for match in matches:
+        receivers.append(int(match.group(1)))
+        n_paths.append(int(match.group(2)))
+        offsets.append(match.start())
+    return (np.array(receivers, dtype=np.int64), np.array(n_paths, dtype=np.int64),
+            np.array(offsets, dtype=np.int64))
+
+
 class P2MDoA(P2mFileParser):
     """Parse a p2m direction of arrival file
     > P2MDoA('iter0.doa.t001_05.r006.p2m').get_data_ndarray()
@@ -91,9 +140,12 @@ class P2MDoA(P2mFileParser):
                           r'\.' +
                           r'p2m$')
     
-    def __init__(self, filename):
+    def __init__(self, filename, dtype_policy='float64', receiver_offsets=None, buffer=None):
         self.filename = filename
         self.file = None
+        self.dtype_policy = get_dtype_policy(dtype_policy)
+        self.receiver_offsets = receiver_offsets
+        self.buffer = buffer
         self._parse()
         
     def get_data_ndarray(self):
@@ -103,12 +155,16 @@ class P2MDoA(P2mFileParser):
         
         If a receiver has less paths than another its path is populated with zeros
         '''
-        data_ndarray = np.zeros((self.n_receivers, self.biggest_n_paths(), 3))
+        data_ndarray = np.zeros((self.n_receivers, self.biggest_n_paths(), 3), dtype=self._direction_dtype())
         for rec_idx, path_dict in enumerate(self.data.values()):
             for path_idx, direction in enumerate(path_dict.values()):
                 data_ndarray[rec_idx][path_idx][:] = direction
         return data_ndarray
     
+    def _direction_dtype(self):
+        # directions hold phi, theta and power
+        return np.result_type(self.dtype_policy.angle, self.dtype_policy.power)
+
     def biggest_n_paths(self):
         ''' find the reciever with the biggest number of received paths'''
         biggest = -np.inf
@@ -126,7 +182,7 @@ class P2MDoA(P2mFileParser):
             line = self._get_next_line()
             sp_line = line.split()
             path = int(sp_line[0])
-            direction = np.array([float(j) for j in sp_line[1:]])
+            direction = np.array([float(j) for j in sp_line[1:]], dtype=self._direction_dtype())
             self.data[receiver][path] = direction
 
 if __name__=='__main__':
@@ -0,0 +1,87 @@
+'''
+Doppler shifts of every ray computed from the arrival/departure angles of a paths file and the
+velocities of the receivers and transmitter, so time-varying channels can be generated without the
+doppler output of InSite.
+
+The angles of paths files are in degrees, angle1 being the zenith angle (theta) and angle2 the azimuth
+(phi). The arrival direction points from the receiver towards where the ray comes from and the
+departure direction from the transmitter along the ray, so a receiver moving along the arrival
+direction (towards the last interaction) sees a positive shift:
+    doppler = frequency / c * (rx_velocity . arrival_direction + tx_velocity . departure_direction)
+> rays, n_paths = P2mPaths('model.paths.t001_01.r002.p2m').get_rays_ndarray()
+> doppler = compute_doppler(rays, n_paths, 60e9, rx_velocity=velocity_from_speed(speeds, headings))
+> gains = get_time_varying_gains(rays, n_paths, doppler, np.arange(100) * 1e-3)
+'''
+import numpy as np
+
+speed_of_light = 299792458.0
+
+# columns of P2mPaths.get_rays_ndarray()
+_power, _departure_theta, _departure_phi, _arrival_theta, _arrival_phi, _phase = 0, 2, 3, 4, 5, 6
+
+
+def angles_to_unit_vectors(theta, phi):
+    """Unit vectors for zenith angles theta and azimuths phi (degrees), shaped (..., 3)"""
+    theta = np.radians(theta)
+    phi = np.radians(phi)
+    sin_theta = np.sin(theta)
+    return np.stack((sin_theta * np.cos(phi), sin_theta * np.sin(phi), np.cos(theta)), axis=-1)
+
+
+def velocity_from_positions(start, end, elapsed_time):
+    """Velocity vectors (m/s) of objects moving from start to end positions (..., 3) in elapsed_time seconds"""
+    return (np.asarray(end, dtype=np.float64) - np.asarray(start, dtype=np.float64)) / elapsed_time
+
+
+def velocity_from_speed(speed, heading, climb=0):
+    """Velocity vectors (..., 3) given the speeds (m/s), the headings (azimuth in degrees, counter
+    clockwise from the x axis) and optionally the climb angles (degrees above the horizontal plane)"""
+    speed = np.asarray(speed, dtype=np.float64)
+    return speed[..., np.newaxis] * angles_to_unit_vectors(90 - np.asarray(climb, dtype=np.float64), heading)
+
+
+def compute_doppler(rays, n_paths, frequency, rx_velocity=None, tx_velocity=None):
+    """Doppler shift (Hz) of every ray, shaped (receivers, paths) and zero for padding
+
+    rays and n_paths are returned by P2mPaths.get_rays_ndarray(). rx_velocity is shaped (3,) for all
+    receivers or (receivers, 3) and tx_velocity (3,), in m/s; None means static
+    """
+    rays = np.asarray(rays, dtype=np.float64)
+    radial_speed = np.zeros(rays.shape[:2])
+    if rx_velocity is not None:
+        arrival = angles_to_unit_vectors(rays[..., _arrival_theta], rays[..., _arrival_phi])
+        rx_velocity = np.broadcast_to(np.asarray(rx_velocity, dtype=np.float64), (rays.shape[0], 3))
+        radial_speed += np.einsum('rpi,ri->rp', arrival, rx_velocity)
+    if tx_velocity is not None:
+        departure = angles_to_unit_vectors(rays[..., _departure_theta], rays[..., _departure_phi])
+        radial_speed += departure @ np.asarray(tx_velocity, dtype=np.float64)
+    doppler = frequency / speed_of_light * radial_speed
+    doppler[np.arange(rays.shape[1]) >= np.asarray(n_paths)[:, np.newaxis]] = 0
+    return doppler
+
+
+def get_time_varying_phase(rays, doppler, times):
+    """Phase (degrees, wrapped to [-180, 180)) of every ray at each time (s), shaped (receivers, paths, times)"""
+    phase = np.asarray(rays, dtype=np.float64)[..., _phase, np.newaxis] + \
+        360 * doppler[..., np.newaxis] * np.asarray(times, dtype=np.float64)
+    return (phase + 180) % 360 - 180
+
+
+def get_time_varying_gains(rays, n_paths, doppler, times):
+    """Complex gain of every ray at each time (s), shaped (receivers, paths, times) and zero for padding
+
+    The magnitude is the square root of the received power in linear scale (dBm converted to W)
+    """
+    rays = np.asarray(rays, dtype=np.float64)
+    magnitude = np.sqrt(10 ** ((rays[..., _power] - 30) / 10))
+    magnitude[np.arange(rays.shape[1]) >= np.asarray(n_paths)[:, np.newaxis]] = 0
+    phase = np.radians(get_time_varying_phase(rays, doppler, times))
+    return magnitude[..., np.newaxis] * np.exp(1j * phase)
+
+
+if __name__ == '__main__':
+    from rwiparsing import P2mPaths
+    rays, n_paths = P2mPaths('../example/iter0.paths.t001_05.r006.p2m').get_rays_ndarray()
+    doppler = compute_doppler(rays, n_paths, 60e9, rx_velocity=velocity_from_speed(10, 0))
+    print('Doppler shifts of receiver 1 (Hz): ', doppler[0])
+    print('Gains of receiver 1: ', get_time_varying_gains(rays, n_paths, doppler, [0, 1e-3])[0])
@@ -0,0 +1,83 @@
+'''
+Dtype policies for the arrays built by the parsers.
+
+Wireless InSite writes 5 to 7 significant digits (e.g. 0.15241E-06, -94.5871, 0.4490798E+01), so the
+relative precision of the text is never better than 5e-7. Storing values with a narrower dtype adds at
+most half a unit in the last place of that dtype:
+    float64: relative error <= 1.1e-16, far below the text precision
+    float32: relative error <= 6.0e-8, i.e. about 7 significant digits: 6 are always kept, the 7th
+             digit of the longest fields (e.g. 0.4490798E+01) may be off by one
+    float16: relative error <= 4.9e-4, i.e. at most 0.125 degrees for angles up to 360 and 0.0625 dB
+             for powers between -256 and -128 dB. Only angles and values in dB use float16; everything
+             else keeps float32 because float16 holds neither coordinates in meters (1 m resolution
+             above 1024 m), times of arrival (it underflows below 6e-8 s), linear powers and field
+             magnitudes (0 below 6e-8) nor throughputs in bps (inf above 65504)
+Ray indices fit int16 (up to 32767 rays per receiver) and receiver indices int32. Only P2mPaths (the
+rays of each receiver) and P2MDoA (the direction of each path) store their data in arrays of these
+dtypes, so only they save memory with a narrower policy. P2mPathParser, P2mCir and P2mFileParser store
+Python floats and use the policy only for the arrays returned by their getters.
+'''
+import numpy as np
+
+
+class DtypePolicy:
+    """Dtypes used for each kind of parsed value"""
+
+    def __init__(self, name, position, time, angle, power, linear, ray_index, receiver_index):
+        self.name = name
+        self.position = np.dtype(position)  # interaction coordinates, receiver positions and distances
+        self.time = np.dtype(time)  # times of arrival and delay spreads
+        self.angle = np.dtype(angle)  # arrival/departure angles and phases
+        self.power = np.dtype(power)  # values in dB: powers, path gains, losses and SINRs
+        self.linear = np.dtype(linear)  # any other value: linear powers, fields, Doppler shifts, throughputs
+        self.ray_index = np.dtype(ray_index)
+        self.receiver_index = np.dtype(receiver_index)
+
+    def __repr__(self):
+        return "DtypePolicy('" + self.name + "')"
+
+    def column_dtype(self, name, fmt, p2m_type=None):
+        """dtype for a column of the headers table given its name, python format and file type"""
+        if fmt is int:
+            return self.receiver_index if name == 'rx' else self.ray_index
+        if fmt is not float:
+            return np.dtype(fmt)
+        if name in ('x', 'y', 'z', 'distance'):
+            return self.position
+        if name in ('toa', 'mtoa', 'delayspread'):
+            return self.time
+        if name in ('phi', 'theta', 'phase') or name.endswith('phs'):
+            return self.angle
+        if name in _db_columns and (p2m_type, name) not in _linear_power_columns:
+            return self.power
+        return self.linear
+
+
+# columns of the headers table written in dB (dBm, dBW or dB)
+_db_columns = {'power', 'pl', 'pg', 'fspl', 'fspl0', 'fspower', 'fspower0', 'txloss', 'xpl', 'xpl0',
+               'interference', 'noise', 'SNR', 'SIR', 'SINR', 'strongest_power', 'total_power',
+               'total_power_with_phase', 'best_SINR', 'RSSI'}
+# power columns in linear scale (W) despite their name
+_linear_power_columns = {('cir', 'power')}
+
+
+dtype_policies = {
+    'float64': DtypePolicy('float64', np.float64, np.float64, np.float64, np.float64, np.float64, np.int64, np.int64),
+    'float32': DtypePolicy('float32', np.float32, np.float32, np.float32, np.float32, np.float32, np.int16, np.int32),
+    'float16': DtypePolicy('float16', np.float32, np.float32, np.float16, np.float16, np.float32, np.int16, np.int32),
+}
+
+
+def get_dtype_policy(dtype_policy):
+    """Return a DtypePolicy given its name ('float64', 'float32', 'float16'), a numpy float type or the policy"""
+    if isinstance(dtype_policy, DtypePolicy):
+        return dtype_policy
+    if dtype_policy is None:
+        return dtype_policies['float64']
+    if not isinstance(dtype_policy, str):
+        dtype_policy = np.dtype(dtype_policy).name  # accept np.float32 and the like
+    try:
+        return dtype_policies[dtype_policy]
+    except KeyError:
+        raise ValueError("unknown dtype policy '" + str(dtype_policy) + "', expected one of " +
+                         ', '.join(dtype_policies))
@@ -1,9 +1,11 @@
 import re
-import os
 import collections
 
 import numpy as np
 
+from .p2mdtype import get_dtype_policy
+from .p2mopen import open_p2m, p2m_basename
+
 # column names for each type of Wireless InSite p2m file
 # TODO: Add a dictionary of units, so that they can be written to new p2m files
 # TODO: path-type files have multiple layers of names, include and identify each layer
@@ -106,9 +108,13 @@ class P2mFileParser:
                           r'\.' +
                           r'p2m$')
 
-    def __init__(self, filename):
+    def __init__(self, filename, dtype_policy='float64', buffer=None):
+        """dtype_policy selects the dtypes of the arrays built from the parsed data, see p2mdtype. If
+        buffer (the bytes of the file) is given it is parsed instead of reading the file"""
         self.filename = filename
         self.file = None
+        self.dtype_policy = get_dtype_policy(dtype_policy)
+        self.buffer = buffer
         self._parse()
 
     def get_data_dict(self):
@@ -117,7 +123,10 @@ class P2mFileParser:
     def get_data_ndarray(self):
         # converts data OrderedDict into ndarray for easier manipulation
         # numpy dtype for indexing columns by name, causes problems so omitted for now
-        dt = np.dtype({'names': headers[self.p2m_type], 'formats': formats[self.p2m_type]})
+        names = headers[self.p2m_type]
+        dt = np.dtype({'names': names,
+                       'formats': [self.dtype_policy.column_dtype(name, fmt, self.p2m_type)
+                                   for name, fmt in zip(names, formats[self.p2m_type])]})
         # data_ndarray = np.zeros((self.n_receivers, len(self.data[0])))
         data_ndarray = np.zeros(self.n_receivers, dtype=dt)
         for i in range(self.n_receivers):
@@ -166,7 +175,7 @@ class P2mFileParser:
 
     def _parse_meta(self):
         match = re.match(P2mFileParser._filename_match_re,
-                         os.path.basename(self.filename))
+                         p2m_basename(self.filename))
 
         self.project = match.group('project')
         self.p2m_type = match.group('type')
@@ -175,7 +184,7 @@ class P2mFileParser:
         self.receiver_set = int(match.group('receiver_set'))
 
     def _parse(self):
-        with open(self.filename) as self.file:
+        with open_p2m(self.filename, buffer=self.buffer) as self.file:
             self._parse_meta()
             self.data = collections.OrderedDict()
             while True:
@@ -216,19 +225,31 @@ class P2mFileParser:
 
 class P2mPathParser(P2mFileParser):
     """Parser for p2m files containing per-path information (e.g. cef, doa, toa)"""
-    def __init__(self, filename):
+    def __init__(self, filename, dtype_policy='float64', receiver_offsets=None, buffer=None):
+        """If receiver_offsets (byte offsets of receiver lines, see p2mdoa.scan_receiver_offsets) is given
+        only those receivers are parsed"""
         self.filename = filename
         self.file = None
+        self.dtype_policy = get_dtype_policy(dtype_policy)
+        self.receiver_offsets = receiver_offsets
+        self.buffer = buffer
         self._parse()
 
     def _parse(self):
-        with open(self.filename) as self.file:
+        with open_p2m(self.filename, buffer=self.buffer) as self.file:
             self._parse_meta()
             self._parse_header()
             self.data = collections.OrderedDict()
             self.data["n_receivers"] = self.n_receivers
-            for rec in range(self.n_receivers):
-                self._parse_receiver()
+            if self.receiver_offsets is None:
+                for rec in range(self.n_receivers):
+                    self._parse_receiver()
+            else:
+                for offset in self.receiver_offsets:
+                    self.file.seek(offset)
+                    self._parse_receiver()
+                self.n_receivers = len(self.data) - 1
+                self.data["n_receivers"] = self.n_receivers
 
     # TODO: Override get_data_ndarray and update_data_dict to account for multi-level data dict
     def _parse_header(self):
@@ -256,9 +277,11 @@ class P2mPathParser(P2mFileParser):
 
 class MIMOCsvParser(P2mFileParser):
     """Parser for csv files generated by the MIMO Output Browser"""
-    def __init__(self, filename):
+    def __init__(self, filename, dtype_policy='float64', buffer=None):
         self.filename = filename
         self.file = None
+        self.dtype_policy = get_dtype_policy(dtype_policy)
+        self.buffer = buffer
         self._parse()
 
     # type.txSet###.txPt###.rxSet###.txEl###.rxEl###.inst###.csv
@@ -280,7 +303,7 @@ class MIMOCsvParser(P2mFileParser):
 
     def _parse_meta(self):
         match = re.match(self._filename_match_re,
-                         os.path.basename(self.filename))
+                         p2m_basename(self.filename))
 
         # self.project = match.group('project')
         self.p2m_type = "MIMO_" + match.group('type')
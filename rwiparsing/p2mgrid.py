@@ -0,0 +1,203 @@
+import numpy as np
+
+from .p2mfileparser import P2mFileParser, ParsingError
+
+# binned maps may have at most this many cells per receiver, so a too small cell_size does not allocate
+# a huge, almost empty map
+max_cells_per_receiver = 64
+
+
+class P2mGrid:
+    """Rasterize single-layer p2m files (power, pl, pg, erms, rsum, noise, tp2...) into 2-D/3-D maps
+
+    The receivers are read from the x, y, z columns of the parsed file. When they form a regular grid
+    written in raster order (x changing fastest, then y, then z) the maps are views of the parsed data,
+    otherwise they are built by binned aggregation.
+    > grid = P2mGrid(P2mFileParser('model.power.t001_01.r002.p2m'))
+    > grid.get_grid_ndarray('power')  # shaped (ny, nx) or (ny, nx, nz)
+    """
+
+    def __init__(self, parser, decimals=3, dtype_policy='float64'):
+        """parser is a parsed single-layer P2mFileParser (or a file name, parsed with dtype_policy) and
+        decimals is the number of decimal places considered when comparing receiver coordinates"""
+        if not isinstance(parser, P2mFileParser):
+            parser = P2mFileParser(parser, dtype_policy)
+        self.parser = parser
+        self.data_ndarray = parser.get_data_ndarray()
+        names = self.data_ndarray.dtype.names
+        if names is None or not all(axis in names for axis in ('x', 'y', 'z')):
+            raise ParsingError("*." + parser.p2m_type + ".p2m files do not have receiver coordinates")
+        self.x = self.data_ndarray['x']
+        self.y = self.data_ndarray['y']
+        self.z = self.data_ndarray['z']
+        self._detect_grid(decimals)
+
+    def _detect_grid(self, decimals):
+        """find the grid axes and whether the receivers can be reshaped without copying"""
+        self.x_axis, ix = np.unique(np.round(self.x, decimals), return_inverse=True)
+        self.y_axis, iy = np.unique(np.round(self.y, decimals), return_inverse=True)
+        self.z_axis, iz = np.unique(np.round(self.z, decimals), return_inverse=True)
+        nx, ny, nz = len(self.x_axis), len(self.y_axis), len(self.z_axis)
+        linear_index = (iz.ravel() * ny + iy.ravel()) * nx + ix.ravel()
+        self.is_regular = (nx * ny * nz == len(self.data_ndarray) and
+                           len(np.unique(linear_index)) == len(self.data_ndarray))
+        # raster order allows reshaping the parsed columns as views, otherwise keep the permutation
+        self.is_raster_order = self.is_regular and np.array_equal(linear_index, np.arange(len(linear_index)))
+        self._linear_index = linear_index
+
+    def get_grid_shape(self):
+        """shape of the regular grid, (ny, nx) for single height grids and (ny, nx, nz) otherwise"""
+        if len(self.z_axis) == 1:
+            return len(self.y_axis), len(self.x_axis)
+        return len(self.y_axis), len(self.x_axis), len(self.z_axis)
+
+    def get_grid_ndarray(self, column, cell_size=None, statistic='mean'):
+        """Return the column as a map indexed by [y, x] (and z, for grids with multiple heights)
+
+        The map of a regular grid in raster order shares memory with the parsed data. Irregular
+        receiver sets are aggregated into square cells of cell_size (see get_binned_ndarray)
+        """
+        if not self.is_regular:
+            return self.get_binned_ndarray(column, cell_size, statistic)[0]
+        values = self.data_ndarray[column]
+        nx, ny, nz = len(self.x_axis), len(self.y_axis), len(self.z_axis)
+        if not self.is_raster_order:
+            ordered = np.empty_like(values)
+            ordered[self._linear_index] = values
+            values = ordered
+        grid = values.reshape((nz, ny, nx)).transpose(1, 2, 0)
+        if nz == 1:
+            return grid[:, :, 0]
+        return grid
+
+    def get_binned_ndarray(self, column, cell_size=None, statistic='mean'):
+        """Aggregate the column over square cells in the x-y plane
+
+        statistic is one of 'mean', 'sum', 'count', 'min' or 'max'. Empty cells are NaN (zero for
+        'sum' and 'count'). If cell_size is None it is chosen from the receiver density, so there is
+        about one receiver per cell. Raise ValueError if the map would have more than
+        max_cells_per_receiver cells per receiver.
+        Return the (ny, nx) map and the x and y coordinates of the cell centers
+        """
+        if cell_size is None:
+            cell_size = self._density_spacing()
+        if not cell_size > 0:
+            raise ValueError('cell_size must be positive')
+        x_min, y_min = self.x.min(), self.y.min()
+        nx = int(np.floor((self.x.max() - x_min) / cell_size + 1e-9)) + 1
+        ny = int(np.floor((self.y.max() - y_min) / cell_size + 1e-9)) + 1
+        if nx * ny > max_cells_per_receiver * len(self.data_ndarray):
+            raise ValueError('cell_size %g gives a %d x %d map for %d receivers, use a larger one' %
+                             (cell_size, ny, nx, len(self.data_ndarray)))
+        ix = np.floor((self.x - x_min) / cell_size + 1e-9).astype(np.int64)
+        iy = np.floor((self.y - y_min) / cell_size + 1e-9).astype(np.int64)
+        flat_index = iy * nx + ix
+        counts = np.bincount(flat_index, minlength=nx * ny)
+        if statistic == 'count':
+            grid = counts.astype(np.float64)
+        else:
+            values = np.asarray(self.data_ndarray[column], dtype=np.float64)
+            if statistic in ('mean', 'sum'):
+                grid = np.bincount(flat_index, weights=values, minlength=nx * ny)
+                if statistic == 'mean':
+                    with np.errstate(invalid='ignore', divide='ignore'):
+                        grid = grid / counts
+            elif statistic in ('min', 'max'):
+                grid = np.full(nx * ny, np.nan)
+                reduce = np.fmin if statistic == 'min' else np.fmax
+                reduce.at(grid, flat_index, values)
+            else:
+                raise ValueError("unknown statistic '" + str(statistic) + "'")
+        x_centers = x_min + (np.arange(nx) + 0.5) * cell_size
+        y_centers = y_min + (np.arange(ny) + 0.5) * cell_size
+        return grid.reshape((ny, nx)), x_centers, y_centers
+
+    def get_value_at(self, column, points, method='nearest', chunk_size=4096):
+        """Look up the column at arbitrary positions
+
+        points is shaped (n_points, 2) for x, y or (n_points, 3) for x, y, z. method is 'nearest' or
+        'bilinear' (regular grids only, with nearest height). Return a ndarray shaped (n_points,)
+        """
+        points = np.atleast_2d(np.asarray(points, dtype=np.float64))
+        values = np.asarray(self.data_ndarray[column], dtype=np.float64)
+        if method == 'nearest':
+            if self.is_regular:
+                return self.get_grid_ndarray(column).reshape(self._query_grid_shape())[self._nearest_cells(points)]
+            return values[self._nearest_receivers(points, chunk_size)]
+        if method == 'bilinear':
+            if not self.is_regular:
+                raise ParsingError("bilinear lookup requires a regular receiver grid")
+            return self._bilinear(self.get_grid_ndarray(column).reshape(self._query_grid_shape()), points)
+        raise ValueError("unknown lookup method '" + str(method) + "'")
+
+    def _query_grid_shape(self):
+        return len(self.y_axis), len(self.x_axis), len(self.z_axis)
+
+    def _nearest_cells(self, points):
+        iy = _nearest_axis_index(self.y_axis, points[:, 1])
+        ix = _nearest_axis_index(self.x_axis, points[:, 0])
+        iz = self._nearest_heights(points)
+        return iy, ix, iz
+
+    def _nearest_heights(self, points):
+        if points.shape[1] < 3:
+            return np.zeros(len(points), dtype=np.int64)
+        return _nearest_axis_index(self.z_axis, points[:, 2])
+
+    def _nearest_receivers(self, points, chunk_size):
+        """brute force nearest receiver search, batched so memory stays bounded"""
+        n_dims = min(points.shape[1], 3)
+        receivers = np.column_stack((self.x, self.y, self.z))[:, :n_dims]
+        nearest = np.empty(len(points), dtype=np.int64)
+        for start in range(0, len(points), chunk_size):
+            chunk = points[start:start + chunk_size, :n_dims]
+            distances = ((chunk[:, np.newaxis, :] - receivers[np.newaxis, :, :]) ** 2).sum(axis=2)
+            nearest[start:start + chunk_size] = distances.argmin(axis=1)
+        return nearest
+
+    def _bilinear(self, grid, points):
+        ix, tx = _interpolation_weights(self.x_axis, points[:, 0])
+        iy, ty = _interpolation_weights(self.y_axis, points[:, 1])
+        iz = self._nearest_heights(points)
+        ix1 = np.minimum(ix + 1, len(self.x_axis) - 1)
+        iy1 = np.minimum(iy + 1, len(self.y_axis) - 1)
+        return ((1 - tx) * (1 - ty) * grid[iy, ix, iz] + tx * (1 - ty) * grid[iy, ix1, iz] +
+                (1 - tx) * ty * grid[iy1, ix, iz] + tx * ty * grid[iy1, ix1, iz])
+
+    def _density_spacing(self):
+        """side of a square cell holding one receiver on average, sqrt(area / n_receivers)"""
+        n_receivers = len(self.data_ndarray)
+        width = float(self.x.max() - self.x.min())
+        height = float(self.y.max() - self.y.min())
+        if width > 0 and height > 0:
+            return np.sqrt(width * height / n_receivers)
+        # receivers on a line (or a single point)
+        if max(width, height) > 0:
+            return max(width, height) / n_receivers
+        return 1.0
+
+
+def _nearest_axis_index(axis, coordinates):
+    """index of the closest value of a sorted axis for each coordinate"""
+    right = np.clip(np.searchsorted(axis, coordinates), 1, max(len(axis) - 1, 1))
+    left = right - 1
+    if len(axis) == 1:
+        return np.zeros(len(coordinates), dtype=np.int64)
+    closer_to_left = np.abs(coordinates - axis[left]) <= np.abs(axis[right] - coordinates)
+    return np.where(closer_to_left, left, right)
+
+
+def _interpolation_weights(axis, coordinates):
+    """lower cell index and the fractional position inside it, clamped to the axis limits"""
+    if len(axis) == 1:
+        return np.zeros(len(coordinates), dtype=np.int64), np.zeros(len(coordinates))
+    index = np.clip(np.searchsorted(axis, coordinates) - 1, 0, len(axis) - 2)
+    weight = (coordinates - axis[index]) / (axis[index + 1] - axis[index])
+    return index, np.clip(weight, 0, 1)
+
+
+if __name__ == '__main__':
+    grid = P2mGrid(P2mFileParser('../example/model.power.t001_01.r002.p2m'))
+    print('regular grid: ', grid.is_regular, grid.get_grid_shape())
+    print('power map: ', grid.get_grid_ndarray('power'))
+    print('power at (10, 0): ', grid.get_value_at('power', [[10, 0]], method='bilinear'))
@@ -0,0 +1,130 @@
+'''
+Background loading of paths files for training pipelines.
+
+> loader = EpisodeLoader(sorted(glob.glob('run*/study/model.paths.t001_01.r002.p2m')), n_workers=4, shuffle=True, seed=0)
+> for filename, rays, n_paths in loader:
+>     ...
+> print(loader.stats)
+'''
+import collections
+import concurrent.futures
+import hashlib
+import os
+import threading
+import time
+
+import numpy as np
+
+from .p2mdtype import get_dtype_policy
+from .p2mopen import p2m_basename, split_archive_member
+from .p2mpaths import P2mPaths
+
+
+def load_rays(filename, dtype_policy='float64', cache_dir=None):
+    """Parse a paths file (or load it from cache_dir) and return P2mPaths.get_rays_ndarray()
+
+    Cached arrays are stored as .npz files and reused while they are newer than the paths file
+    """
+    dtype_policy = get_dtype_policy(dtype_policy)
+    cache_filename = None
+    if cache_dir is not None:
+        cache_filename = _cache_filename(cache_dir, filename, dtype_policy)
+        source_mtime = os.path.getmtime(split_archive_member(filename)[0])
+        if os.path.exists(cache_filename) and os.path.getmtime(cache_filename) >= source_mtime:
+            with np.load(cache_filename) as cached:
+                return cached['rays'], cached['n_paths']
+    rays, n_paths = P2mPaths(filename, dtype_policy).get_rays_ndarray()
+    if cache_filename is not None:
+        os.makedirs(cache_dir, exist_ok=True)
+        # write to a temporary name so concurrent loaders never read a partial file
+        temporary_filename = '%s.%d.%d.tmp.npz' % (cache_filename, os.getpid(), threading.get_ident())
+        np.savez(temporary_filename, rays=rays, n_paths=n_paths)
+        os.replace(temporary_filename, cache_filename)
+    return rays, n_paths
+
+
+def _cache_filename(cache_dir, filename, dtype_policy):
+    archive, member = split_archive_member(filename)
+    key = hashlib.sha1((os.path.abspath(archive) + str(member)).encode()).hexdigest()[:16]
+    return os.path.join(cache_dir, p2m_basename(filename) + '.' + key + '.' + dtype_policy.name + '.npz')
+
+
+class EpisodeLoader:
+    """Iterate over paths files, parsing the upcoming ones on a thread or process pool
+
+    Each item is a tuple (filename, rays, n_paths) as returned by P2mPaths.get_rays_ndarray(). At most
+    prefetch files are parsed ahead of the consumer. With shuffle the order of each epoch is drawn from
+    seed and the epoch number, so runs are reproducible. stats counts how many times the consumer had
+    to wait for a file (starved) and for how long (wait_time, in seconds); frequent starvation means
+    more workers are needed.
+    """
+
+    def __init__(self, filenames, n_workers=4, prefetch=8, shuffle=False, seed=None, use_processes=False,
+                 cache_dir=None, dtype_policy='float64'):
+        if prefetch < 1:
+            raise ValueError("prefetch must be at least 1")
+        self.filenames = list(filenames)
+        self.n_workers = n_workers
+        self.prefetch = prefetch
+        self.shuffle = shuffle
+        self.seed = seed
+        self.use_processes = use_processes
+        self.cache_dir = cache_dir
+        # processes receive the policy name, which is picklable
+        self.dtype_policy = get_dtype_policy(dtype_policy).name
+        self.epoch = 0
+        self.stats = {'items': 0, 'starved': 0, 'wait_time': 0.0}
+
+    def __len__(self):
+        return len(self.filenames)
+
+    def get_order(self, epoch):
+        """order in which the files are yielded in the given epoch"""
+        if not self.shuffle:
+            return np.arange(len(self.filenames))
+        seed = None if self.seed is None else (self.seed, epoch)
+        return np.random.RandomState(seed).permutation(len(self.filenames))
+
+    def get_starvation_ratio(self):
+        """fraction of the items the consumer had to wait for"""
+        if self.stats['items'] == 0:
+            return 0.0
+        return self.stats['starved'] / self.stats['items']
+
+    def __iter__(self):
+        order = self.get_order(self.epoch)
+        self.epoch += 1
+        if self.use_processes:
+            executor = concurrent.futures.ProcessPoolExecutor(self.n_workers)
+        else:
+            executor = concurrent.futures.ThreadPoolExecutor(self.n_workers)
+        pending = collections.deque()
+        next_item = 0
+        try:
+            while next_item < len(order) or pending:
+                # keep the queue full
+                while next_item < len(order) and len(pending) < self.prefetch:
+                    filename = self.filenames[order[next_item]]
+                    pending.append((filename, executor.submit(load_rays, filename, self.dtype_policy,
+                                                              self.cache_dir)))
+                    next_item += 1
+                filename, future = pending.popleft()
+                if not future.done():
+                    self.stats['starved'] += 1
+                    start = time.perf_counter()
+                    concurrent.futures.wait([future])
+                    self.stats['wait_time'] += time.perf_counter() - start
+                rays, n_paths = future.result()
+                self.stats['items'] += 1
+                yield filename, rays, n_paths
+        finally:
+            for filename, future in pending:
+                future.cancel()
+            executor.shutdown(wait=True)
+
+
+if __name__ == '__main__':
+    loader = EpisodeLoader(['../example/iter0.paths.t001_05.r006.p2m'] * 10, n_workers=2, shuffle=True, seed=0)
+    for filename, rays, n_paths in loader:
+        print(filename, rays.shape, n_paths.sum())
+    print('stats: ', loader.stats, 'starvation ratio: ', loader.get_starvation_ratio())
@@ -0,0 +1,153 @@
+'''
+Opening of plain, compressed (gzip, bz2, xz) and archived p2m files.
+
+Members of tar archives (.tar, .tar.gz, .tgz, .tar.bz2, .tar.xz) are named archive::member, e.g.
+'run00001.tar.xz::run00001/study/model.paths.t001_01.r002.p2m', and can be given to the parsers as
+any other file name. The metadata of the file is taken from the member name. Opening a member of a
+compressed archive decompresses the archive up to it, so to read many members use
+iter_archive_members, which decompresses the archive once and hands each member to the parsers as buffer.
+> P2mPaths('model.paths.t001_01.r002.p2m.gz')
+> for member, buffer in iter_archive_members('run00001.tar.xz', 'paths'):
+>     P2mPaths(member, buffer=buffer)
+'''
+import bz2
+import contextlib
+import gzip
+import io
+import lzma
+import os
+import tarfile
+
+archive_separator = '::'
+# decompression is done in blocks of this size (bytes)
+block_size = 1 << 20
+
+compression_openers = {
+    '.gz': gzip.open,
+    '.bz2': bz2.open,
+    '.xz': lzma.open,
+}
+
+
+def split_archive_member(filename):
+    """Return (archive, member) for archive::member names and (filename, None) otherwise"""
+    filename = os.fspath(filename)
+    if archive_separator in filename:
+        archive, member = filename.split(archive_separator, 1)
+        return archive, member
+    return filename, None
+
+
+def p2m_basename(filename):
+    """Base name of a (possibly compressed or archived) p2m file, without the compression suffix"""
+    archive, member = split_archive_member(filename)
+    name = os.path.basename(archive if member is None else member)
+    root, extension = os.path.splitext(name)
+    if extension in compression_openers:
+        return root
+    return name
+
+
+def list_archive_members(archive, p2m_type=None):
+    """List the p2m files of a tar archive as archive::member names, optionally only of one type"""
+    with tarfile.open(archive, 'r|*') as tar:
+        return [archive + archive_separator + member.name for member in tar if _is_p2m_member(member, p2m_type)]
+
+
+def iter_archive_members(archive, p2m_type=None):
+    """Read the p2m files of a tar archive (optionally only of one type) in a single pass over its stream
+
+    Yield the archive::member name and the bytes of each member, in the order of the archive. The bytes
+    are what read_p2m_bytes returns and can be given to the parsers as buffer
+    """
+    with tarfile.open(archive, 'r|*') as tar:
+        for member in tar:
+            if _is_p2m_member(member, p2m_type):
+                with tar.extractfile(member) as file:
+                    yield archive + archive_separator + member.name, file.read()
+
+
+def read_archive_members(filenames):
+    """Read archive::member files of the same archive in a single pass, return a dict of their bytes"""
+    filenames = set(filenames)
+    archives = set(split_archive_member(filename)[0] for filename in filenames)
+    if len(archives) != 1:
+        raise ValueError('the members must belong to a single archive, not ' + str(len(archives)))
+    archive = archives.pop()
+    buffers = {}
+    with tarfile.open(archive, 'r|*') as tar:
+        for member in tar:
+            filename = archive + archive_separator + member.name
+            if filename in filenames and member.isfile():
+                with tar.extractfile(member) as file:
+                    buffers[filename] = file.read()
+                if len(buffers) == len(filenames):
+                    break
+    missing = filenames.difference(buffers)
+    if missing:
+        raise KeyError('not found in ' + archive + ': ' + ', '.join(sorted(missing)))
+    return buffers
+
+
+def _is_p2m_member(member, p2m_type):
+    if not member.isfile():
+        return False
+    name = p2m_basename(member.name)
+    if not name.endswith('.p2m') and not name.endswith('.csv'):
+        return False
+    return p2m_type is None or _p2m_type(name) == p2m_type
+
+
+def _p2m_type(name):
+    # project.type.tx_y.rz.p2m or type.txSet###.txPt###.rxSet###.txEl###.rxEl###.inst###.csv
+    parts = name.split('.')
+    if name.endswith('.csv'):
+        return parts[0]
+    return parts[-4] if len(parts) >= 4 else None
+
+
+def read_p2m_bytes(filename):
+    """Read the content of a p2m file (or archive member) in a single read, without decompressing it
+
+    Each archive member read scans the archive, use read_archive_members or iter_archive_members to
+    read many members of the same archive
+    """
+    archive, member = split_archive_member(filename)
+    if member is not None:
+        with tarfile.open(archive, 'r:*') as tar, tar.extractfile(member) as file:
+            return file.read()
+    with open(archive, 'rb', buffering=0) as file:
+        return file.read()
+
+
+@contextlib.contextmanager
+def open_p2m(filename, mode='rt', buffer=None):
+    """Open a plain, compressed or archived p2m file for reading, in text ('rt') or binary ('rb') mode
+
+    If buffer (the bytes of the file, see read_p2m_bytes) is given the file is read from memory and
+    filename is only used to know whether it is compressed. Compressed streams are decompressed in
+    blocks of block_size bytes. Text is decoded as latin-1, so one character is one byte and offsets
+    into the file are the same in both modes
+    """
+    if mode not in ('rt', 'rb'):
+        raise ValueError("p2m files can only be opened for reading, not with mode '" + mode + "'")
+    archive, member = split_archive_member(filename)
+    with contextlib.ExitStack() as stack:
+        if buffer is not None:
+            binary_file = stack.enter_context(io.BytesIO(buffer))
+            name = archive if member is None else member
+        elif member is not None:
+            tar = stack.enter_context(tarfile.open(archive, 'r:*'))
+            binary_file = stack.enter_context(tar.extractfile(member))
+            name = member
+        else:
+            binary_file = stack.enter_context(open(archive, 'rb', buffering=block_size))
+            name = archive
+        extension = os.path.splitext(name)[1]
+        if extension in compression_openers:
+            binary_file = stack.enter_context(compression_openers[extension](binary_file, 'rb'))
+            binary_file = stack.enter_context(io.BufferedReader(binary_file, buffer_size=block_size))
+        if mode == 'rb':
+            yield binary_file
+        else:
+            yield stack.enter_context(io.TextIOWrapper(binary_file, encoding='latin-1'))
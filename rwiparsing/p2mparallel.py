@@ -0,0 +1,148 @@
+'''
+Parallel parsing of a single large file.
+
+The receiver lines are located with a fast scan (p2mdoa.scan_receiver_offsets), the file is split
+into byte ranges of about the same size at those lines and each range is parsed on a process pool.
+Works with the parsers accepting receiver_offsets: P2mPaths, P2MDoA, P2mCir and P2mPathParser. The
+workers send the rays of P2mPaths and P2MDoA back as a few stacked arrays, which the parser in the main
+process keeps as they are; the other parsers send their parsed data as it is.
+Compressed files and archive members cannot be read from an offset without decompressing them from
+the start, so they are rejected: decompress them first or parse them with the parser directly.
+> paths = parse_parallel(P2mPaths, 'model.paths.t001_01.r002.p2m', n_workers=8)
+'''
+import collections
+import concurrent.futures
+import os
+
+import numpy as np
+
+from .p2mdoa import P2MDoA, scan_receiver_offsets
+from .p2mdtype import get_dtype_policy
+from .p2mopen import compression_openers, split_archive_member
+from .p2mpaths import P2mPaths, PathsReceiver
+
+
+def split_receiver_offsets(offsets, n_chunks, file_size=None):
+    """Split the receiver offsets into at most n_chunks groups covering byte ranges of about the same size"""
+    if len(offsets) == 0:
+        return []
+    end = file_size if file_size is not None else offsets[-1] + 1
+    edges = np.searchsorted(offsets, np.linspace(offsets[0], end, n_chunks + 1)[1:-1])
+    return [chunk for chunk in np.split(offsets, edges) if len(chunk) > 0]
+
+
+def _paths_columns(parser):
+    """stack the receivers of a P2mPaths into arrays"""
+    data = parser.data
+    receivers = [receiver for receiver in data.values() if receiver is not None]
+    labels, codes = np.unique([label for receiver in receivers for label in receiver.interactions_list],
+                              return_inverse=True)
+    return {
+        'receivers': np.array(list(data.keys()), dtype=np.int64),
+        'n_paths': np.array([0 if receiver is None else len(receiver.rays) for receiver in data.values()],
+                            dtype=np.int64),
+        'statistics': np.array([(receiver.received_power, receiver.arrival_time, receiver.spread_delay)
+                                for receiver in receivers], dtype=np.float64).reshape(-1, 3),
+        'rays': (np.concatenate([receiver.rays for receiver in receivers]) if receivers
+                 else np.zeros(0, dtype=parser._rays_dtype(False))),
+        'labels': labels.tolist(),
+        'codes': codes.ravel(),
+        'coordinates': (np.concatenate([receiver.coordinates for receiver in receivers]) if receivers
+                        else np.zeros((0, 3), dtype=parser.dtype_policy.position)),
+    }
+
+
+def _paths_data(columns):
+    """P2mPaths data of the receivers stacked by _paths_columns, viewing the stacked arrays"""
+    data = collections.OrderedDict()
+    labels = columns['labels']
+    interactions_list = [labels[code] for code in columns['codes'].tolist()]
+    n_coordinates = np.cumsum(columns['rays']['n_interactions'].astype(np.int64) + 2)
+    ray_idx = coordinate_idx = statistics_idx = 0
+    for receiver, n_paths in zip(columns['receivers'].tolist(), columns['n_paths'].tolist()):
+        if n_paths == 0:
+            data[receiver] = None
+            continue
+        received_power, arrival_time, spread_delay = columns['statistics'][statistics_idx].tolist()
+        coordinate_end = int(n_coordinates[ray_idx + n_paths - 1])
+        data[receiver] = PathsReceiver(received_power, arrival_time, spread_delay,
+                                       columns['rays'][ray_idx:ray_idx + n_paths],
+                                       interactions_list[ray_idx:ray_idx + n_paths],
+                                       columns['coordinates'][coordinate_idx:coordinate_end])
+        ray_idx += n_paths
+        coordinate_idx = coordinate_end
+        statistics_idx += 1
+    return data
+
+
+def _doa_columns(parser):
+    """stack the directions of a P2MDoA into arrays"""
+    data = parser.data
+    directions = [direction for receiver in data.values() for direction in receiver.values()]
+    return {
+        'receivers': np.array(list(data.keys()), dtype=np.int64),
+        'n_paths': np.array([len(receiver) for receiver in data.values()], dtype=np.int64),
+        'paths': np.array([path for receiver in data.values() for path in receiver], dtype=np.int64),
+        'directions': np.stack(directions) if directions else np.zeros((0, 3), dtype=parser._direction_dtype()),
+    }
+
+
+def _doa_data(columns):
+    """P2MDoA data of the receivers stacked by _doa_columns, viewing the stacked arrays"""
+    data = collections.OrderedDict()
+    paths = columns['paths'].tolist()
+    start = 0
+    for receiver, n_paths in zip(columns['receivers'].tolist(), columns['n_paths'].tolist()):
+        data[receiver] = collections.OrderedDict(zip(paths[start:start + n_paths],
+                                                     columns['directions'][start:start + n_paths]))
+        start += n_paths
+    return data
+
+
+def _parse_chunk(parser_class, filename, dtype_policy, offsets):
+    parser = parser_class(filename, dtype_policy, offsets)
+    if issubclass(parser_class, P2mPaths):
+        return _paths_columns(parser)
+    if issubclass(parser_class, P2MDoA):
+        return _doa_columns(parser)
+    return parser.data
+
+
+def parse_parallel(parser_class, filename, n_workers=None, dtype_policy='float64', n_chunks=None):
+    """Parse a file with parser_class on a process pool and return the parser, as parser_class(filename)
+
+    The file is split into n_chunks (default: 4 per worker, to balance the load) at receiver boundaries.
+    Raise ValueError for compressed files and archive members
+    """
+    archive, member = split_archive_member(filename)
+    if member is not None or os.path.splitext(archive)[1] in compression_openers:
+        raise ValueError(filename + ' is compressed or archived, it cannot be parsed in parallel')
+    n_workers = n_workers if n_workers is not None else os.cpu_count()
+    n_chunks = n_chunks if n_chunks is not None else 4 * n_workers
+    dtype_policy = get_dtype_policy(dtype_policy).name
+    receivers, n_paths, offsets = scan_receiver_offsets(filename)
+    chunks = split_receiver_offsets(offsets, n_chunks, os.path.getsize(archive))
+    # the parser only reads the header here, the receivers are filled in from the chunks
+    parser = parser_class(filename, dtype_policy, [])
+    with concurrent.futures.ProcessPoolExecutor(n_workers) as executor:
+        futures = [executor.submit(_parse_chunk, parser_class, filename, dtype_policy, chunk.tolist())
+                   for chunk in chunks]
+        for future in futures:
+            chunk_data = future.result()
+            if issubclass(parser_class, P2mPaths):
+                chunk_data = _paths_data(chunk_data)
+            elif issubclass(parser_class, P2MDoA):
+                chunk_data = _doa_data(chunk_data)
+            chunk_data.pop("n_receivers", None)
+            parser.data.update(chunk_data)
+    parser.receiver_offsets = None
+    parser.n_receivers = len(receivers)
+    if "n_receivers" in parser.data:
+        parser.data["n_receivers"] = parser.n_receivers
+    return parser
+
+
+if __name__ == '__main__':
+    paths = parse_parallel(P2mPaths, '../example/iter0.paths.t001_05.r006.p2m', n_workers=2)
+    print('receivers: ', list(paths.data.keys()))
+    print('Arrival angles: ', paths.get_arrival_angle_ndarray(1))
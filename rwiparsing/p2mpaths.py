@@ -3,67 +3,134 @@ Change log:
 AK - April 19, 2019 - provided support to InSite version 3.3, which includes path phase into p2m file.
 '''
 import collections
+import collections.abc
+import sys
 
 import numpy as np
 
 from .p2mdoa import P2mFileParser  #use this option to run from command line
 #from p2mdoa import P2mFileParser  #use this option to run from within IntelliJ IDE and debug
 
+
+class PathsReceiver(collections.abc.Mapping):
+    """Data of a receiver of a paths file
+
+    The rays are stored in typed arrays (one record per ray in rays, the interaction coordinates of all
+    rays stacked in coordinates) so their size follows the dtype policy, and are seen through the same
+    keys as before: receiver['received_power'], receiver[ray_n]['srcvdpower'],
+    receiver[ray_n]['interactions']['0']
+    """
+    __slots__ = ('received_power', 'arrival_time', 'spread_delay', 'rays', 'interactions_list',
+                 'coordinates', 'first_coordinate')
+    _statistics = ('received_power', 'arrival_time', 'spread_delay', 'paths_number')
+
+    def __init__(self, received_power, arrival_time, spread_delay, rays, interactions_list, coordinates):
+        self.received_power = received_power
+        self.arrival_time = arrival_time
+        self.spread_delay = spread_delay
+        self.rays = rays
+        self.interactions_list = interactions_list
+        self.coordinates = coordinates
+        # index of the Tx coordinates of each ray in coordinates
+        self.first_coordinate = np.concatenate(([0], np.cumsum(rays['n_interactions'] + 2)[:-1]))
+
+    def __getitem__(self, key):
+        if isinstance(key, str):
+            if key == 'paths_number':
+                return len(self.rays)
+            if key in self._statistics:
+                return getattr(self, key)
+        elif 1 <= key <= len(self.rays):
+            return PathsRay(self, int(key) - 1)
+        raise KeyError(key)
+
+    def __iter__(self):
+        yield from self._statistics
+        yield from range(1, len(self.rays) + 1)
+
+    def __len__(self):
+        return len(self._statistics) + len(self.rays)
+
+
+class PathsRay(collections.abc.Mapping):
+    """View of a ray of a PathsReceiver, with the keys srcvdpower, phase (version 3.3 only), arrival_time,
+    arrival_angle1, arrival_angle2, departure_angle1, departure_angle2, interactions_list, interactions
+    and n_interactions"""
+    __slots__ = ('receiver', 'index')
+
+    def __init__(self, receiver, index):
+        self.receiver = receiver
+        self.index = index
+
+    def __getitem__(self, key):
+        if key == 'interactions_list':
+            return self.receiver.interactions_list[self.index]
+        if key == 'interactions':
+            first = self.receiver.first_coordinate[self.index]
+            n_points = int(self.receiver.rays['n_interactions'][self.index]) + 2
+            return collections.OrderedDict((str(i), self.receiver.coordinates[first + i]) for i in range(n_points))
+        if key == 'n_interactions':
+            return int(self.receiver.rays['n_interactions'][self.index])
+        if key not in self.receiver.rays.dtype.names:
+            raise KeyError(key)
+        return self.receiver.rays[key][self.index]
+
+    def __iter__(self):
+        yield from (name for name in self.receiver.rays.dtype.names if name != 'n_interactions')
+        yield from ('interactions_list', 'interactions', 'n_interactions')
+
+    def __len__(self):
+        return len(self.receiver.rays.dtype.names) + 2
+
+
 class P2mPaths(P2mFileParser):
     """Parse a p2m paths file"""
 
+    def _rays_dtype(self, with_phase):
+        policy = self.dtype_policy
+        fields = [('srcvdpower', policy.power)]
+        if with_phase:
+            fields.append(('phase', policy.angle))
+        fields += [('arrival_time', policy.time), ('arrival_angle1', policy.angle), ('arrival_angle2', policy.angle),
+                   ('departure_angle1', policy.angle), ('departure_angle2', policy.angle),
+                   ('n_interactions', policy.ray_index)]
+        return np.dtype(fields)
+
     def _parse_receiver(self):
         """Get receiver and number of paths (pair Tx-Rx)"""
         line = self._get_next_line()
         receiver, n_paths = [int(i) for i in line.split()]
-        self.data[receiver] = collections.OrderedDict() #note we use a dictionary (hash table) to store information
         if n_paths == 0:
             self.data[receiver] = None
             return
-        """Read: received_power -self.data[receiver][0]-, arrival_time -self.data[receiver][1]-,
-         spread_delay -self.data[receiver][2]-"""
+        """Read: received_power, arrival_time, spread_delay"""
         #These are statistics per receiver (accounts for all paths)
         line = self._get_next_line()
         received_power, arrival_time, spread_delay = [float(i) for i in line.split()]
-        self.data[receiver]['received_power'] = received_power
-        self.data[receiver]['arrival_time'] = arrival_time
-        self.data[receiver]['spread_delay'] = spread_delay
-        self.data[receiver]['paths_number'] = n_paths
         """Read for version 3.2: srcvdpower, arrival_time, arrival_angle1, arrival_angle2, departure_angle1, departure_angle2"""
         """or read for version 3.3: srcvdpower, phase, arrival_time, arrival_angle1, arrival_angle2, departure_angle1, departure_angle2"""
-        #now get statistics per path
-        for rays in range(0,n_paths):
+        #now get statistics per path, collected in lists and stored as typed arrays
+        rays = []
+        interactions_list = []
+        coordinates = []
+        for ray in range(0,n_paths):
             line = self._get_next_line()
             line_values_as_list = line.split() #split line and organize values as list
-            if len(line_values_as_list) == 8: #version 3.2
-                ray_n, n_interactions, srcvdpower, arrival_time, arrival_angle1, arrival_angle2, departure_angle1, departure_angle2 = [float(i) for i in line.split()]
-            elif len(line_values_as_list) == 9: #version 3.3
-                ray_n, n_interactions, srcvdpower, phase, arrival_time, arrival_angle1, arrival_angle2, departure_angle1, departure_angle2  = [float(i) for i in line.split()]
-            else:
-                raise Exception(line + ' has ' + len(line_values_as_list) + ' but was expecting 8 or 9!')
-            interactions_list = self._get_next_line().strip()
-            ray_n = int(ray_n)
-            n_interactions = int(n_interactions)
-            self.data[receiver][ray_n] = collections.OrderedDict()
-            self.data[receiver][ray_n]['srcvdpower'] = srcvdpower
-            if len(line_values_as_list) == 9: #version 3.3
-                self.data[receiver][ray_n]['phase'] = phase
-            self.data[receiver][ray_n]['arrival_time'] = arrival_time
-            self.data[receiver][ray_n]['arrival_angle1'] = arrival_angle1
-            self.data[receiver][ray_n]['arrival_angle2'] = arrival_angle2
-            self.data[receiver][ray_n]['departure_angle1'] = departure_angle1
-            self.data[receiver][ray_n]['departure_angle2'] = departure_angle2
-            self.data[receiver][ray_n]['interactions_list'] = interactions_list
-            self.data[receiver][ray_n]['interactions'] = collections.OrderedDict()
-            self.data[receiver][ray_n]['n_interactions'] = n_interactions #store integer
+            if len(line_values_as_list) not in (8, 9): #version 3.2 or 3.3
+                raise Exception(line + ' has ' + str(len(line_values_as_list)) + ' but was expecting 8 or 9!')
+            if int(line_values_as_list[0]) != ray + 1:
+                raise Exception(line + ' is not ray ' + str(ray + 1))
+            n_interactions = int(line_values_as_list[1])
+            rays.append(tuple(float(i) for i in line_values_as_list[2:]) + (n_interactions,))
+            # the same few interaction sequences repeat over all rays, so share the strings
+            interactions_list.append(sys.intern(self._get_next_line().strip()))
             """Get coordinates of interactions"""
             for i in range(n_interactions+2): #add 2 to take in account Tx and Rx
-                line = self._get_next_line()
-                sp_line = line.split()
-                interaction = i 
-                coordinates = np.array([float(j) for j in sp_line[0:]])
-                #self.data[receiver][ray_n]['interactions'][interactions_list.split('-')[i]] = coordinates
-                self.data[receiver][ray_n]['interactions'][str(interaction)] = coordinates
+                coordinates.extend(float(j) for j in self._get_next_line().split())
+        rays_dtype = self._rays_dtype(len(line_values_as_list) == 9)
+        self.data[receiver] = PathsReceiver(received_power, arrival_time, spread_delay,
+                                            np.array(rays, dtype=rays_dtype), interactions_list,
+                                            np.array(coordinates, dtype=self.dtype_policy.position).reshape(-1, 3))
 
     def get_total_received_power(self, antenna_number):
         if self.data[antenna_number] is None:
@@ -83,30 +150,17 @@ class P2mPaths(P2mFileParser):
     def get_arrival_time_ndarray(self, antenna_number):
         if self.data[antenna_number] is None:
             return None
-        data_ndarray = np.zeros((self.data[antenna_number]['paths_number'],))
-        for paths in range(self.data[antenna_number]['paths_number']):
-            data_ndarray[paths] = self.data[antenna_number][paths+1]['arrival_time']
-        return data_ndarray
+        return self.data[antenna_number].rays['arrival_time'].astype(self.dtype_policy.time)
 
     def get_interactions_list(self, antenna_number):
         if self.data[antenna_number] is None:
             return None
-        data = []
-        for paths in range(self.data[antenna_number]['paths_number']):
-            data.append(self.data[antenna_number][paths+1]['interactions_list'])
-        return data
+        return list(self.data[antenna_number].interactions_list)
 
     def get_interactions_positions(self, antenna_number, ray_number):
         if self.data[antenna_number] is None:
             return None
-        if self.data[antenna_number][ray_number] is None:
-            return None
-        data = []
-        #self.data[receiver][ray_n]['interactions'][interaction]
-        #add 2 to take in account Tx and Rx
-        for paths in range(2 + self.data[antenna_number][ray_number]['n_interactions']):
-            data.append(self.data[antenna_number][ray_number]['interactions'][str(paths)])
-        return data
+        return list(self.data[antenna_number][ray_number]['interactions'].values())
 
     def get_interactions_positions_as_string(self, antenna_number, ray_number):
         data = self.get_interactions_positions(antenna_number, ray_number)
@@ -123,11 +177,8 @@ class P2mPaths(P2mFileParser):
         """
         if self.data[antenna_number] is None:
             return None
-        data_ndarray = np.zeros((self.data[antenna_number]['paths_number'], 2))
-        for paths in range(self.data[antenna_number]['paths_number']):
-            data_ndarray[paths][0]= self.data[antenna_number][paths+1]['departure_angle1']
-            data_ndarray[paths][1]= self.data[antenna_number][paths+1]['departure_angle2']
-        return data_ndarray
+        rays = self.data[antenna_number].rays
+        return np.column_stack((rays['departure_angle1'], rays['departure_angle2'])).astype(self.dtype_policy.angle)
 
     def get_arrival_angle_ndarray(self, antenna_number):
         """Return the arrival angles as a ndarray
@@ -135,11 +186,8 @@ class P2mPaths(P2mFileParser):
         """
         if self.data[antenna_number] is None:
             return None
-        data_ndarray = np.zeros((self.data[antenna_number]['paths_number'], 2))
-        for paths in range(self.data[antenna_number]['paths_number']):
-            data_ndarray[paths][0]= self.data[antenna_number][paths+1]['arrival_angle1']
-            data_ndarray[paths][1]= self.data[antenna_number][paths+1]['arrival_angle2']
-        return data_ndarray
+        rays = self.data[antenna_number].rays
+        return np.column_stack((rays['arrival_angle1'], rays['arrival_angle2'])).astype(self.dtype_policy.angle)
 
     def get_p_gain_ndarray(self, antenna_number):
         """Return the gains as a ndarray
@@ -147,48 +195,37 @@ class P2mPaths(P2mFileParser):
         """
         if self.data[antenna_number] is None:
             return None
-        data_ndarray = np.zeros((self.data[antenna_number]['paths_number']))
-        for paths in range(self.data[antenna_number]['paths_number']):
-            data_ndarray[paths] = self.data[antenna_number][paths+1]['srcvdpower']
-        return data_ndarray
+        return self.data[antenna_number].rays['srcvdpower'].astype(self.dtype_policy.power)
 
     def get_p_phase_ndarray(self, antenna_number):
         """Return the phases as a ndarray.
         """
         if self.data[antenna_number] is None:
             return None
-        data_ndarray = np.zeros((self.data[antenna_number]['paths_number']))
-        for paths in range(self.data[antenna_number]['paths_number']):
-            data_ndarray[paths] = self.data[antenna_number][paths+1]['phase']
-        return data_ndarray
+        rays = self.data[antenna_number].rays
+        if 'phase' not in rays.dtype.names:
+            raise KeyError('phase')
+        return rays['phase'].astype(self.dtype_policy.angle)
 
     def is_los(self, antenna_number):
         '''Check if each ray  (not the whole channel) is LOS or not'''
         if self.data[antenna_number] is None:
             return None
-        num_paths = self.data[antenna_number]['paths_number']
-        data_ndarray = np.zeros((num_paths,))
-        for path_i in range(num_paths):
-            interaction = self.data[antenna_number][path_i+1]['interactions_list']
-            if interaction == 'Tx-Rx':
-                data_ndarray[path_i] = 1 #it is LOS
-            else:
-                data_ndarray[path_i] = 0 #it is not LOS
-        return data_ndarray
+        interactions_list = self.data[antenna_number].interactions_list
+        return np.array([interaction == 'Tx-Rx' for interaction in interactions_list], dtype=np.float64)
 
     def is_los_through_foliage(self, antenna_number):
         '''Check if each ray  (not the whole channel) is LOS or not'''
         if self.data[antenna_number] is None:
             return None
-        num_paths = self.data[antenna_number]['paths_number']
-        data_ndarray = np.zeros((num_paths,))
-        for path_i in range(num_paths):
-            interaction = self.data[antenna_number][path_i+1]['interactions_list']
-            if interaction == 'Tx-F-Rx' or interaction == 'Tx-F-X-Rx':
-                data_ndarray[path_i] = 1 #it is LOS
-            else:
-                data_ndarray[path_i] = 0 #it is not LOS
-        return data_ndarray
+        interactions_list = self.data[antenna_number].interactions_list
+        return np.array([interaction in ('Tx-F-Rx', 'Tx-F-X-Rx') for interaction in interactions_list],
+                        dtype=np.float64)
+
+    def _parameters_dtype(self):
+        # a single dtype able to hold gains, times, angles and phases
+        policy = self.dtype_policy
+        return np.result_type(policy.power, policy.time, policy.angle)
 
     def get_6_parameters_for_all_rays(self, antenna_number):
         """Useful for version 3.2, which does not inform the phase on .p2m files.
@@ -210,7 +247,7 @@ class P2mPaths(P2mFileParser):
         if self.data[antenna_number] is None:
             return None
         num_paths = self.data[antenna_number]['paths_number']
-        data_ndarray = np.zeros((num_paths,6))
+        data_ndarray = np.zeros((num_paths,6), dtype=self._parameters_dtype())
         data_ndarray[:,0]=self.get_p_gain_ndarray(antenna_number)
         data_ndarray[:,1]=self.get_arrival_time_ndarray(antenna_number)
         data_ndarray[:,2:4] = self.get_departure_angle_ndarray(antenna_number)
@@ -233,7 +270,7 @@ class P2mPaths(P2mFileParser):
         if self.data[antenna_number] is None:
             return None
         num_paths = self.data[antenna_number]['paths_number']
-        data_ndarray = np.zeros((num_paths,7))
+        data_ndarray = np.zeros((num_paths,7), dtype=self._parameters_dtype())
         data_ndarray[:,0]=self.get_p_gain_ndarray(antenna_number)
         data_ndarray[:,1]=self.get_arrival_time_ndarray(antenna_number)
         data_ndarray[:,2:4] = self.get_departure_angle_ndarray(antenna_number)
@@ -241,6 +278,28 @@ class P2mPaths(P2mFileParser):
         data_ndarray[:,6] = self.get_p_phase_ndarray(antenna_number)
         return data_ndarray
 
+    _ray_parameters = ('srcvdpower', 'arrival_time', 'departure_angle1', 'departure_angle2',
+                       'arrival_angle1', 'arrival_angle2', 'phase')
+
+    def get_rays_ndarray(self):
+        """Return the 7 parameters of all rays of all receivers (same order as get_7_parameters_for_all_rays)
+        The array is shaped (number_receivers, biggest_number_paths, 7), receivers in the order they
+        appear in the file, and is zero padded. Version 3.2 files have no phase, which is left as zero.
+        Also return the number of paths of each receiver as a ndarray shaped (number_receivers,)
+        """
+        receivers = list(self.data.values())
+        n_paths = np.array([0 if receiver is None else receiver['paths_number'] for receiver in receivers],
+                           dtype=self.dtype_policy.ray_index)
+        biggest_n_paths = int(n_paths.max()) if len(n_paths) > 0 else 0
+        data_ndarray = np.zeros((len(receivers), biggest_n_paths, 7), dtype=self._parameters_dtype())
+        for rec_idx, receiver in enumerate(receivers):
+            if receiver is None:
+                continue
+            for column, name in enumerate(self._ray_parameters):
+                if name in receiver.rays.dtype.names:
+                    data_ndarray[rec_idx, :len(receiver.rays), column] = receiver.rays[name]
+        return data_ndarray, n_paths
+
 if __name__=='__main__':
     #InSite version 3.2 example:
     #path = P2mPaths('D:/insitedata/results_long_episodes/run00000/study/model.paths.t001_01.r002.p2m')
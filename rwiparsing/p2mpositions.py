@@ -2,7 +2,8 @@ import collections
 import numpy as np
 # from .p2mdoa import P2mFileParser
 import re
-import os
+
+from .p2mopen import open_p2m, p2m_basename
 
 
 class ParsingError(Exception):
@@ -35,14 +36,14 @@ class P2mFileParser:
 
     def _parse_meta(self):
         match = re.match(P2mFileParser._filename_match_re,
-                         os.path.basename(self.filename))
+                         p2m_basename(self.filename))
         self.project = match.group('project')
         self.transmitter_set = int(match.group('transmitter_set'))
         self.transmitter = int(match.group('transmitter'))
         self.receiver_set = int(match.group('receiver_set'))
 
     def _parse(self):
-        with open(self.filename) as self.file:
+        with open_p2m(self.filename) as self.file:
             self._parse_meta()
             self._parse_header()
             self.data = collections.OrderedDict()
@@ -0,0 +1,142 @@
+'''
+All rays of a scene in a single store.
+
+A scene with several transmitter points and receiver sets is written as one paths file per
+tNNN_MM.rKKK combination. P2mScene concatenates the rays of all of them into one array, with index
+arrays mapping each ray back to its transmitter, transmitter set, receiver set and receiver, so queries
+across links (e.g. the best serving transmitter of each receiver) are single vectorized operations.
+> scene = P2mScene('run00001/study')
+> receiver_set, receiver, transmitter, transmitter_set, power = scene.get_best_serving_transmitter()
+'''
+import glob
+import os
+import re
+
+import numpy as np
+
+from .p2mdoa import P2mFileParser, scan_receiver_offsets
+from .p2mdtype import get_dtype_policy
+from .p2mopen import p2m_basename
+from .p2mpaths import P2mPaths
+
+
+class P2mScene:
+    """Rays of all paths files of a scene
+
+    rays is shaped (n_rays, 7) with the parameters of P2mPaths.get_rays_ndarray(). For each ray, link
+    is the index of its file in filenames and transmitter, transmitter_set, receiver_set, receiver and
+    ray are its numbers in the files; rx is the index of its receiver in receivers, the (receiver_set,
+    receiver) pairs of the scene. link_power holds the received power (dBm) InSite writes for each link
+    and receiver, shaped (n_links, len(receivers))
+    """
+
+    def __init__(self, scene, dtype_policy='float64', project=None):
+        """scene is a directory (its paths files are used, optionally only those of project) or a list
+        of paths file names"""
+        if isinstance(scene, str):
+            pattern = (glob.escape(project) if project is not None else '*') + '.paths.t*_*.r*.p2m*'
+            scene = glob.glob(os.path.join(glob.escape(scene), pattern))
+        self.dtype_policy = get_dtype_policy(dtype_policy)
+        links = []
+        for filename in scene:
+            match = re.match(P2mFileParser._filename_match_re, p2m_basename(filename))
+            if match is None or match.group('type') != 'paths':
+                raise ValueError(filename + ' is not a paths file name')
+            links.append((int(match.group('transmitter')), int(match.group('transmitter_set')),
+                          int(match.group('receiver_set')), filename))
+        links.sort()
+        self.filenames = [filename for *meta, filename in links]
+        self.link_transmitter = np.array([link[0] for link in links], dtype=self.dtype_policy.receiver_index)
+        self.link_transmitter_set = np.array([link[1] for link in links], dtype=self.dtype_policy.receiver_index)
+        self.link_receiver_set = np.array([link[2] for link in links], dtype=self.dtype_policy.receiver_index)
+        self._assemble()
+
+    def _assemble(self):
+        """fill the global arrays straight from the parsed data, one file at a time"""
+        # the rays are counted first, so only one parsed file is held while the arrays are filled
+        n_rays = sum(int(scan_receiver_offsets(filename)[1].sum()) for filename in self.filenames)
+        policy = self.dtype_policy
+        self.rays = np.zeros((n_rays, 7), dtype=np.result_type(policy.power, policy.time, policy.angle))
+        self.link = np.empty(n_rays, dtype=policy.receiver_index)
+        self.receiver = np.empty(n_rays, dtype=policy.receiver_index)
+        self.ray = np.empty(n_rays, dtype=policy.ray_index)
+        self.interactions = np.empty(n_rays, dtype=object)
+        # received power of each link and receiver, as written by InSite
+        power_link, power_receiver, power = [], [], []
+        ray_idx = 0
+        for link_idx, filename in enumerate(self.filenames):
+            paths = P2mPaths(filename, policy)
+            if ray_idx + sum(receiver['paths_number'] for receiver in paths.data.values()
+                             if receiver is not None) > n_rays:
+                raise ValueError(filename + ' changed while the scene was loaded')
+            for receiver_number, receiver in paths.data.items():
+                if receiver is None:
+                    continue
+                n_paths = receiver['paths_number']
+                for column, name in enumerate(P2mPaths._ray_parameters):
+                    if name in receiver.rays.dtype.names:
+                        self.rays[ray_idx:ray_idx + n_paths, column] = receiver.rays[name]
+                self.interactions[ray_idx:ray_idx + n_paths] = receiver.interactions_list
+                self.link[ray_idx:ray_idx + n_paths] = link_idx
+                self.receiver[ray_idx:ray_idx + n_paths] = receiver_number
+                self.ray[ray_idx:ray_idx + n_paths] = np.arange(1, n_paths + 1)
+                power_link.append(link_idx)
+                power_receiver.append(receiver_number)
+                power.append(receiver['received_power'])
+                ray_idx += n_paths
+            del paths
+        if ray_idx != n_rays:
+            raise ValueError('the files of the scene changed while it was loaded')
+        self.transmitter = self.link_transmitter[self.link]
+        self.transmitter_set = self.link_transmitter_set[self.link]
+        self.receiver_set = self.link_receiver_set[self.link]
+        pairs = np.stack((self.receiver_set, self.receiver), axis=1)
+        self.receivers, self.rx = np.unique(pairs, axis=0, return_inverse=True)
+        self.rx = self.rx.ravel()
+        self.n_links = len(self.filenames)
+        self.link_power = np.full((self.n_links, len(self.receivers)), -np.inf)
+        if power:
+            power_link = np.array(power_link)
+            self.link_power[power_link, self._receiver_index(self.link_receiver_set[power_link], power_receiver)] = power
+
+    def _receiver_index(self, receiver_set, receiver):
+        """index in receivers of (receiver_set, receiver) pairs of the scene"""
+        # receivers is sorted by receiver set, then receiver, so the pairs map to sorted keys
+        base = int(self.receivers[:, 1].max()) + 1
+        keys = self.receivers[:, 0].astype(np.int64) * base + self.receivers[:, 1]
+        return np.searchsorted(keys, np.asarray(receiver_set, dtype=np.int64) * base + np.asarray(receiver, dtype=np.int64))
+
+    def select(self, transmitter=None, transmitter_set=None, receiver_set=None, receiver=None):
+        """Boolean mask of the rays of the given transmitter, transmitter set, receiver set and receiver"""
+        mask = np.ones(len(self.rays), dtype=bool)
+        for values, value in ((self.transmitter, transmitter), (self.transmitter_set, transmitter_set),
+                              (self.receiver_set, receiver_set), (self.receiver, receiver)):
+            if value is not None:
+                mask &= np.isin(values, value)
+        return mask
+
+    def get_link_power_ndarray(self):
+        """Total received power (dBm) of every link (file) and receiver, shaped (n_links, len(receivers))
+
+        The totals are the received powers written by InSite, not sums over the rays. -inf where a
+        receiver gets no ray from the link
+        """
+        return self.link_power
+
+    def get_best_serving_transmitter(self):
+        """Transmitter with the strongest total power at each receiver of the scene
+
+        Return the receiver sets, receivers, best transmitters, their transmitter sets and the power
+        (dBm), shaped (len(receivers),)
+        """
+        power = self.get_link_power_ndarray()
+        best = np.argmax(power, axis=0)
+        return (self.receivers[:, 0], self.receivers[:, 1], self.link_transmitter[best],
+                self.link_transmitter_set[best], power[best, np.arange(len(self.receivers))])
+
+
+if __name__ == '__main__':
+    scene = P2mScene('../example')
+    print('links: ', scene.filenames)
+    print('rays: ', scene.rays.shape)
+    print('best serving transmitter: ', scene.get_best_serving_transmitter())
@@ -0,0 +1,123 @@
+'''
+Tracking of rays (multipath components) across consecutive scenes of a mobility simulation.
+
+Each scene is a paths file (e.g. run00000, run00001, ... of the same transmitter and receiver set).
+The rays of every receiver are linked to the rays of the same receiver in the previous scene when they
+have the same interactions and their angles and delays are within the gates. Linked rays share a
+track ID; every scene is only compared with the previous one, so the cost is linear in the number of
+scenes.
+> tracker = RayTracker(sorted(glob.glob('run*/study/model.paths.t001_01.r002.p2m')))
+> scenes, receivers, rays = tracker.get_track_ndarray(0)
+'''
+import numpy as np
+
+from .p2mdiff import match_rays, paths_ray_table, ray_differences
+from .p2mpaths import P2mPaths
+
+# columns of P2mPaths.get_rays_ndarray() used to link rays and the kind of each one
+_linked_columns = np.array([1, 2, 3, 4, 5])
+_linked_kinds = ['time', 'angle', 'angle', 'angle', 'angle']
+
+
+class RayTracker:
+    """Assign persistent track IDs to the rays of consecutive scenes
+
+    angle_gate (degrees) and delay_gate (seconds) are the largest changes between two scenes for rays
+    to be linked. After the scenes are added, track_ids[scene] is shaped like the rays of the scene
+    (receivers, paths) and is -1 for padding. Receivers are linked in chunks of at most max_pairs pairs
+    of rays, which bounds the memory used to compare two scenes
+    """
+
+    def __init__(self, scenes=(), angle_gate=5.0, delay_gate=5e-9, max_pairs=1 << 20):
+        self.angle_gate = angle_gate
+        self.delay_gate = delay_gate
+        self.max_pairs = max_pairs
+        self.receivers = []
+        self.rays = []
+        self.n_paths = []
+        self.track_ids = []
+        self.n_tracks = 0
+        self._previous = None
+        self._track_index = None
+        for scene in scenes:
+            self.add_scene(scene)
+
+    def add_scene(self, scene):
+        """Link the rays of a scene (a paths file name or a P2mPaths) to the previous scene"""
+        if not isinstance(scene, P2mPaths):
+            scene = P2mPaths(scene)
+        receivers, rays, n_paths, labels = paths_ray_table(scene)
+        track_ids = np.full(rays.shape[:2], -1, dtype=np.int64)
+        valid = np.arange(rays.shape[1]) < n_paths[:, np.newaxis]
+        if self._previous is not None:
+            self._link(receivers, rays, n_paths, labels, track_ids)
+        # rays not linked to the previous scene start new tracks
+        new_tracks = valid & (track_ids < 0)
+        track_ids[new_tracks] = self.n_tracks + np.arange(np.count_nonzero(new_tracks))
+        self.n_tracks += np.count_nonzero(new_tracks)
+        self._previous = (receivers, rays, n_paths, labels, track_ids)
+        self._track_index = None
+        self.receivers.append(receivers)
+        self.rays.append(rays)
+        self.n_paths.append(n_paths)
+        self.track_ids.append(track_ids)
+
+    def _link(self, receivers, rays, n_paths, labels, track_ids):
+        previous_receivers, previous_rays, previous_n_paths, previous_labels, previous_track_ids = self._previous
+        _, index, previous_index = np.intersect1d(receivers, previous_receivers, return_indices=True)
+        gate = np.array([self.delay_gate] + [self.angle_gate] * 4)
+        chunk_size = max(1, self.max_pairs // max(1, rays.shape[1] * previous_rays.shape[1]))
+        for start in range(0, len(index), chunk_size):
+            chunk_index = index[start:start + chunk_size]
+            chunk_previous_index = previous_index[start:start + chunk_size]
+            # cost of every pair of rays of the receivers of the chunk, shaped (receivers, paths, previous paths)
+            cost = ray_differences(rays[chunk_index][:, :, np.newaxis, _linked_columns],
+                                   previous_rays[chunk_previous_index][:, np.newaxis, :, _linked_columns],
+                                   _linked_kinds) / gate
+            cost = cost.max(axis=3)
+            cost[labels[chunk_index][:, :, np.newaxis] != previous_labels[chunk_previous_index][:, np.newaxis, :]] = np.inf
+            for chunk_idx, (rec_idx, previous_rec_idx) in enumerate(zip(chunk_index, chunk_previous_index)):
+                receiver_cost = cost[chunk_idx, :n_paths[rec_idx], :previous_n_paths[previous_rec_idx]]
+                if receiver_cost.size == 0:
+                    continue
+                rows, columns = match_rays(receiver_cost, 1.0)
+                track_ids[rec_idx, rows] = previous_track_ids[previous_rec_idx, columns]
+
+    def _build_track_index(self):
+        """flat table of all rays sorted by track, to look up time series"""
+        if not self.rays:
+            empty = np.zeros(0, dtype=np.int64)
+            self._track_index = (empty, empty, empty, np.zeros((0, 7)))
+            return
+        scenes, receivers, track_ids, rays = [], [], [], []
+        for scene, (scene_receivers, scene_rays, scene_track_ids) in enumerate(zip(self.receivers, self.rays,
+                                                                                   self.track_ids)):
+            valid = scene_track_ids >= 0
+            scenes.append(np.full(np.count_nonzero(valid), scene))
+            receivers.append(np.broadcast_to(scene_receivers[:, np.newaxis], valid.shape)[valid])
+            track_ids.append(scene_track_ids[valid])
+            rays.append(scene_rays[valid])
+        track_ids = np.concatenate(track_ids)
+        order = np.argsort(track_ids, kind='stable')  # stable keeps scenes in order within a track
+        self._track_index = (track_ids[order], np.concatenate(scenes)[order], np.concatenate(receivers)[order],
+                             np.concatenate(rays)[order])
+
+    def get_track_ndarray(self, track_id):
+        """Return the scenes, receivers and rays (the 7 parameters of P2mPaths.get_rays_ndarray()) of a track"""
+        if self._track_index is None:
+            self._build_track_index()
+        track_ids, scenes, receivers, rays = self._track_index
+        start, stop = np.searchsorted(track_ids, [track_id, track_id + 1])
+        return scenes[start:stop], receivers[start:stop], rays[start:stop]
+
+    def get_track_lengths(self):
+        """number of scenes of each track, shaped (n_tracks,)"""
+        if self._track_index is None:
+            self._build_track_index()
+        return np.bincount(self._track_index[0], minlength=self.n_tracks)
+
+
+if __name__ == '__main__':
+    tracker = RayTracker(['../example/iter0.paths.t001_05.r006.p2m'] * 3)
+    print('number of tracks: ', tracker.n_tracks)
+    print('track 0: ', tracker.get_track_ndarray(0))
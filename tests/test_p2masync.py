@@ -0,0 +1,90 @@
+import tarfile
+import time
+
+import numpy as np
+
+from rwiparsing import P2mPaths
+from rwiparsing.p2masync import load, with_latency
+from rwiparsing.p2mdoa import P2MDoA
+from rwiparsing.p2mopen import read_archive_members
+
+latency = 0.05
+n_files = 20
+
+
+def doa_content(seed):
+    lines = ['# Receiver Set: test\n', '3\n']
+    for receiver in range(1, 4):
+        lines.append('%d %d\n' % (receiver, receiver))
+        for path in range(1, receiver + 1):
+            lines.append('%d %d.5 9%d.25 -%d.5\n' % (path, seed, path, 90 + receiver))
+    return ''.join(lines)
+
+
+paths_content = ('# Receiver Set: test\n'
+                 '2\n'
+                 '1 2\n'
+                 '-93.44 0.15486E-06 0.82734E-08\n'
+                 '1 0 -94.5871 0.15241E-06 85.9851 356.8557 94.0149 176.8557\n'
+                 'Tx-Rx\n'
+                 '50 17 5\n'
+                 '4.490798 19.5 1.801\n'
+                 '2 1 -94.5930 0.15251E-06 90.0064 358.3005 95.0000 176.5000\n'
+                 'Tx-R-Rx\n'
+                 '50 17 5\n'
+                 '13.49206 19.23292 1.8\n'
+                 '4.490798 19.5 1.801\n'
+                 '2 0\n')
+
+
+def write_files(directory):
+    filenames = []
+    for index in range(n_files):
+        filename = directory / ('model%d.doa.t001_01.r002.p2m' % index)
+        filename.write_text(doa_content(index))
+        filenames.append(str(filename))
+    filename = directory / 'model.paths.t001_01.r002.p2m'
+    filename.write_text(paths_content)
+    filenames.append(str(filename))
+    return filenames
+
+
+def assert_same_parsers(parsers, filenames):
+    for parser, filename in zip(parsers, filenames):
+        if isinstance(parser, P2mPaths):
+            expected = P2mPaths(filename)
+            for array, expected_array in zip(parser.get_rays_ndarray(), expected.get_rays_ndarray()):
+                np.testing.assert_array_equal(array, expected_array)
+            assert parser.get_interactions_list(1) == expected.get_interactions_list(1)
+        else:
+            assert isinstance(parser, P2MDoA)
+            np.testing.assert_array_equal(parser.get_data_ndarray(), P2MDoA(filename).get_data_ndarray())
+
+
+def test_concurrent_beats_serial(tmp_path):
+    filenames = write_files(tmp_path)
+    reader = with_latency(latency)
+    start = time.perf_counter()
+    serial = load(filenames, max_concurrency=1, reader=reader)
+    serial_time = time.perf_counter() - start
+    start = time.perf_counter()
+    concurrent = load(filenames, max_concurrency=len(filenames), reader=reader)
+    concurrent_time = time.perf_counter() - start
+    assert serial_time >= latency * len(filenames)
+    assert concurrent_time < serial_time / 3
+    assert_same_parsers(serial, filenames)
+    assert_same_parsers(concurrent, filenames)
+
+
+def test_archive_members(tmp_path):
+    filenames = write_files(tmp_path)
+    archive = str(tmp_path / 'run.tar.gz')
+    with tarfile.open(archive, 'w:gz') as tar:
+        for filename in filenames:
+            tar.add(filename, arcname='study/' + filename.rsplit('/', 1)[-1])
+    members = [archive + '::study/' + filename.rsplit('/', 1)[-1] for filename in filenames]
+    start = time.perf_counter()
+    parsers = load(members, archive_reader=with_latency(latency, read_archive_members))
+    # all the members are read together, waiting for the latency once
+    assert time.perf_counter() - start < latency * 5
+    assert_same_parsers(parsers, members)
@@ -0,0 +1,70 @@
+import numpy as np
+import pytest
+
+from rwiparsing import P2mPaths
+from rwiparsing.p2mdoa import P2MDoA
+from rwiparsing.p2mparallel import parse_parallel
+
+
+def paths_file(n_receivers, n_paths):
+    lines = ['# Receiver Set: test\n', '%d\n' % len(n_paths)]
+    for receiver in range(1, n_receivers + 1):
+        paths = n_paths[receiver - 1]
+        lines.append('%d %d\n' % (receiver, paths))
+        if paths == 0:
+            continue
+        lines.append('-93.44 0.15486E-06 0.82734E-08\n')
+        for ray in range(1, paths + 1):
+            n_interactions = ray % 2
+            lines.append('%d %d -%.4f 0.1524%dE-06 85.%d 356.8557 94.0149 176.%d\n' %
+                         (ray, n_interactions, 90 + ray, ray, receiver, ray))
+            lines.append('Tx-Rx\n' if n_interactions == 0 else 'Tx-R-Rx\n')
+            for point in range(n_interactions + 2):
+                lines.append('%d.5 %d.25 1.8\n' % (receiver, point))
+    return ''.join(lines)
+
+
+def doa_file(n_paths):
+    lines = ['# Receiver Set: test\n', '%d\n' % len(n_paths)]
+    for receiver, paths in enumerate(n_paths, 1):
+        lines.append('%d %d\n' % (receiver, paths))
+        for path in range(1, paths + 1):
+            lines.append('%d %d.5 9%d.25 -9%d.5\n' % (path, receiver, path, path))
+    return ''.join(lines)
+
+
+# receivers with paths, then a long run of receivers without any, then some with paths again
+n_paths = [3] * 20 + [0] * 200 + [2] * 5
+
+
+def test_paths(tmp_path):
+    filename = str(tmp_path / 'model.paths.t001_01.r002.p2m')
+    with open(filename, 'w') as file:
+        file.write(paths_file(len(n_paths), n_paths))
+    sequential = P2mPaths(filename)
+    parallel = parse_parallel(P2mPaths, filename, n_workers=2, n_chunks=8)
+    assert list(parallel.data.keys()) == list(sequential.data.keys())
+    for receiver, data in sequential.data.items():
+        if data is None:
+            assert parallel.data[receiver] is None
+            continue
+        assert parallel.get_interactions_list(receiver) == sequential.get_interactions_list(receiver)
+        assert parallel.get_total_received_power(receiver) == sequential.get_total_received_power(receiver)
+        for ray in range(1, data['paths_number'] + 1):
+            for expected, position in zip(sequential.get_interactions_positions(receiver, ray),
+                                          parallel.get_interactions_positions(receiver, ray)):
+                np.testing.assert_array_equal(position, expected)
+    for expected, array in zip(sequential.get_rays_ndarray(), parallel.get_rays_ndarray()):
+        np.testing.assert_array_equal(array, expected)
+
+
+@pytest.mark.parametrize('n_paths', [n_paths, [3] * 10 + [0] * 490])
+def test_doa(tmp_path, n_paths):
+    filename = str(tmp_path / 'model.doa.t001_01.r002.p2m')
+    with open(filename, 'w') as file:
+        file.write(doa_file(n_paths))
+    sequential = P2MDoA(filename)
+    parallel = parse_parallel(P2MDoA, filename, n_workers=2, n_chunks=8)
+    assert list(parallel.data.keys()) == list(sequential.data.keys())
+    assert [list(paths) for paths in parallel.data.values()] == [list(paths) for paths in sequential.data.values()]
+    np.testing.assert_array_equal(parallel.get_data_ndarray(), sequential.get_data_ndarray())
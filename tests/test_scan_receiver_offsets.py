@@ -0,0 +1,53 @@
+import numpy as np
+import pytest
+
+from rwiparsing.p2mdoa import scan_receiver_offsets
+
+# per-path files with receivers 1 (2 paths), 2 (no path) and 3 (1 path), the receiver lines being the
+# only lines with exactly two integers
+files = {
+    'cef': ('# Receiver Set: test\n'
+            '3\n'
+            '1 2\n'
+            '1 1.0E-03 45.0 2.0E-03 90.0 1 0 2 0 3 0\n'
+            '2 1.5E-03 -45.0 2.5E-03 -90.0 1 0 2 0 3 0\n'
+            '2 0\n'
+            '3 1\n'
+            '1 1.0E-03 45.0 2.0E-03 90.0 1 0 2 0 3 0\n'),
+    'cir': ('# Receiver Set: test\n'
+            '3\n'
+            '1 2\n'
+            '1 45 1.5E-07 1.0E-12\n'
+            '2 90 1.6E-07 1.0E-12\n'
+            '2 0\n'
+            '3 1\n'
+            '1 0 1.5E-07 1.0E-12\n'),
+    'toa': ('# Receiver Set: test\n'
+            '3\n'
+            '1 2\n'
+            '1 1.5E-07 -94.5\n'
+            '2 1.6E-07 -95\n'
+            '2 0\n'
+            '3 1\n'
+            '1 1.5E-07 -94\n'),
+}
+
+
+@pytest.mark.parametrize('p2m_type', sorted(files))
+def test_receiver_lines(tmp_path, p2m_type):
+    content = files[p2m_type]
+    filename = tmp_path / ('model.' + p2m_type + '.t001_01.r002.p2m')
+    filename.write_text(content)
+    receivers, n_paths, offsets = scan_receiver_offsets(str(filename))
+    np.testing.assert_array_equal(receivers, [1, 2, 3])
+    np.testing.assert_array_equal(n_paths, [2, 0, 1])
+    np.testing.assert_array_equal(offsets, [content.index('\n1 2\n') + 1, content.index('\n2 0\n') + 1,
+                                            content.index('\n3 1\n') + 1])
+
+
+@pytest.mark.parametrize('p2m_type', sorted(files))
+def test_receiver_lines_from_buffer(p2m_type):
+    content = files[p2m_type].encode()
+    receivers, n_paths, offsets = scan_receiver_offsets('model.' + p2m_type + '.t001_01.r002.p2m', content)
+    np.testing.assert_array_equal(receivers, [1, 2, 3])
+    np.testing.assert_array_equal(n_paths, [2, 0, 1])